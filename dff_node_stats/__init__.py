@@ -1,5 +1,7 @@
 # flake8: noqa: F401
 from .stats import Stats
+from .flush import FlushPolicy
+from .buffer import BufferLimit, Overflow
 
 from .savers import Saver
 from . import collectors
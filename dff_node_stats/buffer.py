@@ -0,0 +1,336 @@
+"""
+Buffer
+**********
+| Defines the :py:class:`~dff_node_stats.buffer.ColumnarBuffer` class that accumulates
+| the rows produced by the collectors between two flushes of :py:class:`~dff_node_stats.stats.Stats`.
+| Rows are stored as plain python lists, one list per column,
+| and are turned into a single :py:class:`~pandas.DataFrame` once per flush.
+| The buffer can be written and drained from different threads.
+| :py:class:`~dff_node_stats.buffer.ShardedBuffer` has the same interface, but keeps a separate
+| buffer for each writing thread, so that concurrent writers never wait for each other.
+| :py:class:`~dff_node_stats.buffer.BufferLimit` caps the size of the buffer and defines what happens on overflow.
+
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from enum import Enum
+import sys
+import threading
+
+import pandas as pd
+
+
+class Overflow(Enum):
+    """
+    Policies applied when the buffer is full.
+
+    Enums:
+
+    BLOCK
+        | Wait until the buffer is flushed. If there is no background flusher to wait for, flush in place.
+        | The incoming row is dropped if the flush fails or takes longer than the timeout of the limit.
+
+    DROP_OLDEST
+        Discard the oldest tenth of the buffered rows.
+
+    DROP_NEWEST
+        Discard the incoming row.
+
+    SPILL
+        Move the buffered rows to disk. They are saved together with the next flush.
+    """
+
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    SPILL = "spill"
+
+
+class BufferLimit:
+    """
+    Caps the number of rows or bytes buffered by :py:class:`~dff_node_stats.stats.Stats`.
+
+    Parameters
+    ----------
+
+    max_rows: Optional[int]
+        The maximum number of buffered rows.
+    max_bytes: Optional[int]
+        The maximum estimated memory footprint of the buffer in bytes.
+    overflow: :py:class:`~dff_node_stats.buffer.Overflow`
+        | What to do when the buffer is full. Defaults to `Overflow.DROP_OLDEST`,
+        | so the dialog turns never wait for the storage.
+    spill_path: Optional[str]
+        The directory for the spilled rows. Required for `Overflow.SPILL`.
+    block_timeout: Optional[float]
+        | For `Overflow.BLOCK`, the maximum number of seconds to wait for a background flush. Defaults to 1 second.
+        | The incoming row is dropped when the timeout expires or the flush fails, `None` waits for the flush result.
+        | Without a background flusher, a failed in-place flush is not retried for the same number of seconds,
+        | the incoming rows are dropped meanwhile.
+    """
+
+    def __init__(
+        self,
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        overflow: Overflow = Overflow.DROP_OLDEST,
+        spill_path: Optional[str] = None,
+        block_timeout: Optional[float] = 1.0,
+    ) -> None:
+        if max_rows is None and max_bytes is None:
+            raise ValueError("At least one of `max_rows`, `max_bytes` should be set")
+        overflow = Overflow(overflow)
+        if overflow is Overflow.SPILL and spill_path is None:
+            raise ValueError("Param `spill_path` is required to spill the buffer")
+        self.max_rows: Optional[int] = max_rows
+        self.max_bytes: Optional[int] = max_bytes
+        self.overflow: Overflow = overflow
+        self.spill_path: Optional[str] = spill_path
+        self.block_timeout: Optional[float] = block_timeout
+
+    def is_full(self, rows: int, nbytes: int) -> bool:
+        return (self.max_rows is not None and rows >= self.max_rows) or (
+            self.max_bytes is not None and nbytes >= self.max_bytes
+        )
+
+    def is_exceeded(self, rows: int, nbytes: int) -> bool:
+        return (self.max_rows is not None and rows > self.max_rows) or (
+            self.max_bytes is not None and nbytes > self.max_bytes
+        )
+
+
+class ColumnarBuffer:
+    """
+    Append-only columnar storage for the collected stats.
+
+    Parameters
+    ----------
+
+    column_dtypes: Dict[str, str]
+        String names and string pandas types of the buffered columns.
+        Columns that are not listed here are still accepted, their type is inferred by pandas.
+    parse_dates: Optional[List[str]]
+        String names of columns that should be converted to datetime.
+    """
+
+    def __init__(self, column_dtypes: Dict[str, str], parse_dates: Optional[List[str]] = None) -> None:
+        self.column_dtypes: Dict[str, str] = column_dtypes
+        self.parse_dates: List[str] = parse_dates or []
+        self._columns: Dict[str, list] = self._empty_columns()
+        self._length: int = 0
+        self._nbytes: int = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Estimated memory footprint of the buffered values in bytes.
+        """
+        return self._nbytes
+
+    def _empty_columns(self) -> Dict[str, list]:
+        return {column: [] for column in self.column_dtypes}
+
+    def _add_column(self, column: str) -> list:
+        values = self._columns[column] = [None] * self._length
+        return values
+
+    def append(self, row: Dict[str, Any]) -> None:
+        """
+        Add a single row to the buffer. Missing columns are filled with `None`.
+        """
+        nbytes = sum(map(sys.getsizeof, row.values()))
+        with self._lock:
+            columns = self._columns
+            for column, value in row.items():
+                values = columns.get(column)
+                if values is None:
+                    values = self._add_column(column)
+                values.append(value)
+            self._length += 1
+            self._nbytes += nbytes
+            for values in columns.values():
+                if len(values) < self._length:
+                    values.append(None)
+
+    def extend(self, stats: Dict[str, List[Any]]) -> None:
+        """
+        Add several rows to the buffer. The input has the format returned by
+        :py:meth:`~dff_node_stats.collectors.Collector.collect_stats`: a dict of equally sized lists.
+        """
+        if not stats:
+            return
+        size = len(next(iter(stats.values())))
+        nbytes = sum(sum(map(sys.getsizeof, values)) for values in stats.values())
+        with self._lock:
+            columns = self._columns
+            for column, values in stats.items():
+                target = columns.get(column)
+                if target is None:
+                    target = self._add_column(column)
+                target.extend(values)
+            self._length += size
+            self._nbytes += nbytes
+            for values in columns.values():
+                if len(values) < self._length:
+                    values.extend([None] * (self._length - len(values)))
+
+    def prepend(self, df: pd.DataFrame) -> None:
+        """
+        Put the rows of a dataframe back at the head of the buffer, e.g. the rows of a failed flush.
+        """
+        if not len(df):
+            return
+        stats = {column: df[column].tolist() for column in df.columns}
+        nbytes = sum(sum(map(sys.getsizeof, values)) for values in stats.values())
+        with self._lock:
+            columns = self._columns
+            for column in stats.keys() - columns.keys():
+                self._add_column(column)
+            for column, values in columns.items():
+                columns[column] = (stats.get(column) or [None] * len(df)) + values
+            self._length += len(df)
+            self._nbytes += nbytes
+
+    def discard_oldest(self, rows: int) -> int:
+        """
+        Remove up to `rows` oldest rows from the buffer. Returns the number of removed rows.
+        """
+        with self._lock:
+            rows = min(rows, self._length)
+            if not rows:
+                return 0
+            self._nbytes -= self._nbytes * rows // self._length
+            for values in self._columns.values():
+                del values[:rows]
+            self._length -= rows
+        return rows
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Build a dataframe from the buffered rows without clearing the buffer.
+        """
+        with self._lock:
+            columns = {column: list(values) for column, values in self._columns.items()}
+        return self._build_dataframe(columns)
+
+    def drain(self) -> pd.DataFrame:
+        """
+        Build a dataframe from the buffered rows and clear the buffer.
+        """
+        columns, _ = self._drain_columns()
+        return self._build_dataframe(columns)
+
+    def _drain_columns(self) -> Tuple[Dict[str, list], int]:
+        with self._lock:
+            columns, self._columns = self._columns, self._empty_columns()
+            length, self._length = self._length, 0
+            self._nbytes = 0
+        return columns, length
+
+    def _build_dataframe(self, columns: Dict[str, list]) -> pd.DataFrame:
+        df = pd.DataFrame(columns)
+        for column, dtype in self.column_dtypes.items():
+            if column not in df.columns or dtype in ("str", "object"):
+                continue
+            if column in self.parse_dates or dtype.startswith("datetime64"):
+                df[column] = pd.to_datetime(df[column])
+                continue
+            try:
+                df[column] = df[column].astype(dtype)
+            except (ValueError, TypeError):  # e.g. missing values in an integer column
+                pass
+        return df
+
+
+class ShardedBuffer:
+    """
+    | A buffer that keeps one :py:class:`~dff_node_stats.buffer.ColumnarBuffer` per writing thread.
+    | Writers only take the lock of their own shard, which is contended only while the shard is drained.
+    | Asyncio tasks of one event loop share the shard of the loop thread:
+    | a row is always appended without yielding control to the loop.
+    | The shards are merged into a single dataframe on :py:meth:`~dff_node_stats.buffer.ShardedBuffer.drain`.
+
+    Parameters
+    ----------
+
+    column_dtypes: Dict[str, str]
+        String names and string pandas types of the buffered columns.
+    parse_dates: Optional[List[str]]
+        String names of columns that should be converted to datetime.
+    """
+
+    def __init__(self, column_dtypes: Dict[str, str], parse_dates: Optional[List[str]] = None) -> None:
+        self.column_dtypes: Dict[str, str] = column_dtypes
+        self.parse_dates: List[str] = parse_dates or []
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, ColumnarBuffer]] = []
+        self._registry_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(shard) for _, shard in self._shards)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(shard.nbytes for _, shard in self._shards)
+
+    @property
+    def shard(self) -> ColumnarBuffer:
+        """
+        The buffer of the current thread.
+        """
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = ColumnarBuffer(self.column_dtypes, self.parse_dates)
+            with self._registry_lock:
+                self._shards = self._shards + [(threading.current_thread(), shard)]
+        return shard
+
+    def append(self, row: Dict[str, Any]) -> None:
+        self.shard.append(row)
+
+    def extend(self, stats: Dict[str, List[Any]]) -> None:
+        self.shard.extend(stats)
+
+    def prepend(self, df: pd.DataFrame) -> None:
+        self.shard.prepend(df)
+
+    def discard_oldest(self, rows: int) -> int:
+        """
+        Remove up to `rows` rows from the shards, starting from the largest one.
+        """
+        removed = 0
+        for _, shard in sorted(self._shards, key=lambda item: len(item[1]), reverse=True):
+            if removed >= rows:
+                break
+            removed += shard.discard_oldest(rows - removed)
+        return removed
+
+    def to_dataframe(self) -> pd.DataFrame:
+        frames = [shard.to_dataframe() for _, shard in self._shards if len(shard)]
+        if not frames:
+            return ColumnarBuffer(self.column_dtypes, self.parse_dates).to_dataframe()
+        return pd.concat(frames, ignore_index=True)
+
+    def drain(self) -> pd.DataFrame:
+        """
+        Drain every shard and merge the rows into a single dataframe.
+        Shards of finished threads are dropped once they are drained.
+        """
+        with self._registry_lock:
+            shards = self._shards
+            self._shards = [(thread, shard) for thread, shard in shards if thread.is_alive()]
+        merged: Dict[str, list] = {column: [] for column in self.column_dtypes}
+        total = 0
+        for _, shard in shards:
+            columns, length = shard._drain_columns()
+            if not length:
+                continue
+            for column in columns.keys() - merged.keys():
+                merged[column] = [None] * total
+            for column, values in merged.items():
+                values.extend(columns.get(column) or [None] * length)
+            total += length
+        return ColumnarBuffer(self.column_dtypes, self.parse_dates)._build_dataframe(merged)
@@ -6,15 +6,26 @@ Collectors
 | Collectors are passed to the (:py:class:`~dff_node_stats.stats.Stats`) class on construction.
 | Their method collect_stats is invoked each turn of the (:py:class:`~df_engine.core.actor.Actor`)
 | to extract and save (:py:class:`~df_engine.core.context.Context`) parameters.
+| Collectors that need to observe the whole turn can also define an `update_actor_handlers(stats, actor)` method,
+| which is called by :py:meth:`~dff_node_stats.stats.Stats.update_actor_handlers` to register extra handlers.
+| Collectors that also implement the :py:class:`~dff_node_stats.collectors.FieldCollector` protocol
+| declare the context fields they need, so that each field is read only once per turn.
+| :py:func:`~dff_node_stats.collectors.compile_collectors` merges a list of collectors
+| into a single extraction function.
 
 """
-from typing import List, Dict, Protocol, runtime_checkable, Any
+from typing import Callable, List, Dict, Protocol, runtime_checkable, Any
 import datetime
+import inspect
+import time
 
 from pydantic import validate_arguments
 from df_engine.core import Context, Actor
+from df_engine.core.types import ActorStage
 import pandas as pd
 
+from .utils import BoundedDict
+
 
 @runtime_checkable
 class Collector(Protocol):
@@ -45,7 +56,59 @@ class Collector(Protocol):
         raise NotImplementedError
 
 
-class DefaultCollector(Collector):
+@runtime_checkable
+class FieldCollector(Collector, Protocol):
+    """
+    | Extended protocol for collectors that declare the :py:class:`~df_engine.core.context.Context` fields they use.
+    | :py:class:`~dff_node_stats.stats.Stats` reads each declared field once per turn
+    | and passes the values to all field collectors, which write their columns straight into the row.
+    | The built-in collectors are called through `extract` only while they keep their `collect_stats` method,
+    | a subclass that overrides `collect_stats` is called through it.
+
+    """
+
+    @property
+    def context_fields(self) -> List[str]:
+        """
+        Names of the context attributes the collector reads
+        """
+        return []
+
+    def extract(self, fields: Dict[str, Any], actor: Actor, row: Dict[str, Any], **kwargs) -> None:
+        """
+        Write the collected values into `row`, using the values of the declared context fields
+        """
+        raise NotImplementedError
+
+
+def _collect_fields(collector: FieldCollector, ctx: Context, actor: Actor, **kwargs) -> Dict[str, Any]:
+    fields = {name: getattr(ctx, name) for name in collector.context_fields}
+    row = dict()
+    collector.extract(fields, actor, row, **kwargs)
+    return {column: [value] for column, value in row.items()}
+
+
+def _delegates_to_extract(method: Callable) -> Callable:
+    """
+    Mark a `collect_stats` method that only runs `extract`, so the compiled extractor may call `extract` directly.
+    """
+    method.delegates_to_extract = True
+    return method
+
+
+def _uses_extract(collector: Collector) -> bool:
+    method = getattr(type(collector), "collect_stats", None)
+    return isinstance(collector, FieldCollector) and getattr(method, "delegates_to_extract", False)
+
+
+class DefaultCollector(FieldCollector):
+    """
+    Collects the context id, the turn index, the turn start time and the turn duration.
+    The duration is measured with :py:func:`time.perf_counter_ns` from the `start_ns` keyword argument.
+    Without `start_ns`, it is measured from the `start_time` keyword argument with the wall clock,
+    and it is missing if neither is given, e.g. when the start of the turn is no longer tracked.
+    """
+
     @property
     def column_dtypes(self) -> Dict[str, str]:
         return {
@@ -59,20 +122,31 @@ class DefaultCollector(Collector):
     def parse_dates(self) -> List[str]:
         return ["start_time"]
 
+    @property
+    def context_fields(self) -> List[str]:
+        return ["id", "labels"]
+
+    def extract(self, fields: Dict[str, Any], actor: Actor, row: Dict[str, Any], **kwargs) -> None:
+        labels = fields["labels"]
+        start_ns = kwargs.get("start_ns")
+        start_time = kwargs.get("start_time")
+        row["context_id"] = str(fields["id"])
+        row["history_id"] = next(reversed(labels)) if labels else -1
+        row["start_time"] = start_time or datetime.datetime.now()
+        if start_ns is not None:
+            row["duration_time"] = (time.perf_counter_ns() - start_ns) / 1e9
+        elif start_time is not None:
+            row["duration_time"] = (datetime.datetime.now() - start_time).total_seconds()
+        else:
+            row["duration_time"] = float("nan")
+
     @validate_arguments
+    @_delegates_to_extract
     def collect_stats(self, ctx: Context, actor: Actor, *args, **kwargs) -> Dict[str, Any]:
-        indexes = list(ctx.labels) or [-1]
-        current_index = indexes[-1]
-        start_time = kwargs.get("start_time") or datetime.datetime.now()
-        return {
-            "context_id": [str(ctx.id)],
-            "history_id": [current_index],
-            "start_time": [start_time],
-            "duration_time": [(datetime.datetime.now() - start_time).total_seconds()],
-        }
+        return _collect_fields(self, ctx, actor, **kwargs)
 
 
-class NodeLabelCollector(Collector):
+class NodeLabelCollector(FieldCollector):
     @property
     def column_dtypes(self) -> Dict[str, str]:
         return {
@@ -84,16 +158,22 @@ class NodeLabelCollector(Collector):
     def parse_dates(self) -> List[str]:
         return []
 
+    @property
+    def context_fields(self) -> List[str]:
+        return ["last_label"]
+
+    def extract(self, fields: Dict[str, Any], actor: Actor, row: Dict[str, Any], **kwargs) -> None:
+        last_label = fields["last_label"] or actor.start_label
+        row["flow_label"] = last_label[0]
+        row["node_label"] = last_label[1]
+
     @validate_arguments
+    @_delegates_to_extract
     def collect_stats(self, ctx: Context, actor: Actor, *args, **kwargs) -> Dict[str, Any]:
-        last_label = ctx.last_label or actor.start_label
-        return {
-            "flow_label": [last_label[0]],
-            "node_label": [last_label[1]],
-        }
+        return _collect_fields(self, ctx, actor, **kwargs)
 
 
-class RequestCollector(Collector):
+class RequestCollector(FieldCollector):
     @property
     def column_dtypes(self) -> Dict[str, str]:
         return {"user_request": "str"}
@@ -102,12 +182,20 @@ class RequestCollector(Collector):
     def parse_dates(self) -> List[str]:
         return []
 
+    @property
+    def context_fields(self) -> List[str]:
+        return ["last_request"]
+
+    def extract(self, fields: Dict[str, Any], actor: Actor, row: Dict[str, Any], **kwargs) -> None:
+        row["user_request"] = fields["last_request"] or ""
+
     @validate_arguments
+    @_delegates_to_extract
     def collect_stats(self, ctx: Context, actor: Actor, *args, **kwargs) -> Dict[str, Any]:
-        return {"user_request": [ctx.last_request or ""]}
+        return _collect_fields(self, ctx, actor, **kwargs)
 
 
-class ResponseCollector(Collector):
+class ResponseCollector(FieldCollector):
     @property
     def column_dtypes(self) -> Dict[str, str]:
         return {"bot_response": "str"}
@@ -116,12 +204,20 @@ class ResponseCollector(Collector):
     def parse_dates(self) -> List[str]:
         return []
 
+    @property
+    def context_fields(self) -> List[str]:
+        return ["last_response"]
+
+    def extract(self, fields: Dict[str, Any], actor: Actor, row: Dict[str, Any], **kwargs) -> None:
+        row["bot_response"] = fields["last_response"] or ""
+
     @validate_arguments
+    @_delegates_to_extract
     def collect_stats(self, ctx: Context, actor: Actor, *args, **kwargs) -> Dict[str, Any]:
-        return {"bot_response": [ctx.last_response or ""]}
+        return _collect_fields(self, ctx, actor, **kwargs)
 
 
-class ContextCollector(Collector):
+class ContextCollector(FieldCollector):
     """
     Parameters
     ----------
@@ -148,10 +244,147 @@ class ContextCollector(Collector):
     def parse_dates(self) -> List[str]:
         return self._parse_dates
 
+    @property
+    def context_fields(self) -> List[str]:
+        return ["misc"]
+
+    def extract(self, fields: Dict[str, Any], actor: Actor, row: Dict[str, Any], **kwargs) -> None:
+        misc = fields["misc"]
+        for key in self.column_dtypes:
+            row[key] = misc.get(key, None)
+
     @validate_arguments
+    @_delegates_to_extract
     def collect_stats(self, ctx: Context, actor: Actor, *args, **kwargs) -> Dict[str, Any]:
-        misc_stats = dict()
-        for key in self.column_dtypes:
-            value = ctx.misc.get(key, None)
-            misc_stats[key] = [value]
-        return misc_stats
+        return _collect_fields(self, ctx, actor, **kwargs)
+
+
+class StageTimingCollector(FieldCollector):
+    """
+    | Collects the duration of each :py:class:`~df_engine.core.types.ActorStage` of the turn in seconds.
+    | The collector registers a handler on every actor stage that records a :py:func:`time.perf_counter_ns`
+    | timestamp, and the duration of a stage is measured from the handlers of the previous stage,
+    | e.g. the `create_response_duration` column holds the time spent in the response function.
+    | Timestamps are kept per context id until the turn is collected on FINISH_TURN.
+    """
+
+    stages: List[ActorStage] = list(ActorStage)
+    max_tracked_contexts: int = 10000
+
+    def __init__(self) -> None:
+        self.timestamps: BoundedDict = BoundedDict(self.max_tracked_contexts)
+        self._columns = [f"{stage.name.lower()}_duration" for stage in self.stages[1:]]
+
+    @property
+    def column_dtypes(self) -> Dict[str, str]:
+        return {column: "float64" for column in self._columns}
+
+    @property
+    def parse_dates(self) -> List[str]:
+        return []
+
+    @property
+    def context_fields(self) -> List[str]:
+        return ["id"]
+
+    def update_actor_handlers(self, stats, actor: Actor) -> Actor:
+        """
+        Register a timestamp handler on every actor stage through
+        :py:meth:`~dff_node_stats.stats.Stats._update_handlers`.
+        """
+        for index, stage in enumerate(self.stages):
+            actor = stats._update_handlers(actor, stage, self._make_handler(index), per_context=True)
+        return actor
+
+    def _make_handler(self, index: int) -> Callable:
+        timestamps = self.timestamps
+        size = len(self.stages)
+
+        if index == 0:
+
+            def handler(ctx: Context, actor: Actor, *args, **kwargs) -> None:
+                stamps = timestamps[ctx.id] = [None] * size
+                stamps[0] = time.perf_counter_ns()
+
+        else:
+
+            def handler(ctx: Context, actor: Actor, *args, **kwargs) -> None:
+                stamps = timestamps.get(ctx.id)
+                if stamps is not None:
+                    stamps[index] = time.perf_counter_ns()
+
+        return handler
+
+    def extract(self, fields: Dict[str, Any], actor: Actor, row: Dict[str, Any], **kwargs) -> None:
+        stamps = self.timestamps.get(fields["id"])
+        if stamps is None:
+            stamps = [None] * len(self.stages)
+        elif stamps[-1] is not None:  # the turn is finished
+            self.timestamps.pop(fields["id"], None)
+        for index, column in enumerate(self._columns, start=1):
+            started, finished = stamps[index - 1], stamps[index]
+            row[column] = (finished - started) / 1e9 if started is not None and finished is not None else None
+
+    @validate_arguments
+    @_delegates_to_extract
+    def collect_stats(self, ctx: Context, actor: Actor, *args, **kwargs) -> Dict[str, Any]:
+        return _collect_fields(self, ctx, actor, **kwargs)
+
+
+ExtractorType = Callable[..., Dict[str, Any]]
+"""
+| The prototype of the function built by :py:func:`~dff_node_stats.collectors.compile_collectors`.
+| It takes the same arguments as :py:meth:`~dff_node_stats.collectors.Collector.collect_stats`
+| and returns a single row: a dict of column names and scalar values.
+
+"""
+
+
+def _unwrap_method(method: Callable) -> Callable:
+    function = getattr(method, "__func__", method)
+    raw_function = inspect.unwrap(function)
+    instance = getattr(method, "__self__", None)
+    return raw_function.__get__(instance) if instance is not None else raw_function
+
+
+def compile_collectors(collectors: List[Collector], trusted: bool = False) -> ExtractorType:
+    """
+    | Build a single function that runs all collectors and merges their output into one row.
+    | The context fields declared by the :py:class:`~dff_node_stats.collectors.FieldCollector` instances
+    | are read once per call and shared between them.
+    | Other collectors, including field collectors that override `collect_stats`,
+    | are called through `collect_stats` and should return one value per column.
+
+    Parameters
+    ----------
+
+    collectors: List[:py:class:`~dff_node_stats.collectors.Collector`]
+        The collectors to run.
+    trusted: bool
+        | Skip the per-call argument validation of the collectors.
+        | The `collect_stats` methods decorated with :py:func:`pydantic.validate_arguments` are unwrapped,
+        | so the arguments should be validated in advance.
+    """
+    field_names = list()
+    steps = list()
+    for collector in collectors:
+        if _uses_extract(collector):
+            field_names.extend(name for name in collector.context_fields if name not in field_names)
+            steps.append((True, collector.extract))
+        else:
+            steps.append((False, _unwrap_method(collector.collect_stats) if trusted else collector.collect_stats))
+    field_names = tuple(field_names)
+    steps = tuple(steps)
+
+    def extract(ctx: Context, actor: Actor, *args, **kwargs) -> Dict[str, Any]:
+        fields = {name: getattr(ctx, name) for name in field_names}
+        row = dict()
+        for reads_fields, function in steps:
+            if reads_fields:
+                function(fields, actor, row, **kwargs)
+            else:
+                for column, values in function(ctx, actor, *args, **kwargs).items():
+                    row[column] = values[0]
+        return row
+
+    return extract
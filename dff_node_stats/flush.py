@@ -0,0 +1,307 @@
+"""
+Flush
+**********
+| Defines the :py:class:`~dff_node_stats.flush.FlushPolicy` class that decides when the collected data
+| should be saved, and the :py:class:`~dff_node_stats.flush.BackgroundFlusher` class that moves
+| :py:meth:`~dff_node_stats.stats.Stats.save` calls out of the :py:class:`~df_engine.core.actor.Actor` turn.
+| The flusher runs as an asyncio task that awaits the async saver methods if it is started
+| inside a running event loop, otherwise it runs in a dedicated daemon thread.
+
+Example::
+
+    stats = Stats(saver=Saver("postgresql://..."), flush_policy=FlushPolicy(max_rows=1000, max_interval=5.0))
+
+    stats.update_actor_handlers(actor, auto_save=True, background=True)
+
+    ...
+
+    stats.close()
+
+"""
+from typing import Dict, Optional
+import asyncio
+import atexit
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class FlushPolicy:
+    """
+    | Defines the thresholds that trigger a flush of the :py:class:`~dff_node_stats.stats.Stats` buffer.
+    | The flush happens as soon as any of the thresholds is reached.
+    | Thresholds that are not set are not checked.
+
+    Parameters
+    ----------
+
+    max_rows: Optional[int]
+        Flush when this number of rows is buffered.
+    max_interval: Optional[float]
+        Flush when this number of seconds has passed since the previous flush.
+    max_bytes: Optional[int]
+        Flush when the estimated memory footprint of the buffer exceeds this number of bytes.
+    """
+
+    def __init__(
+        self, max_rows: Optional[int] = None, max_interval: Optional[float] = None, max_bytes: Optional[int] = None
+    ) -> None:
+        if all(threshold is None for threshold in (max_rows, max_interval, max_bytes)):
+            raise ValueError("At least one of `max_rows`, `max_interval`, `max_bytes` should be set")
+        self.max_rows: Optional[int] = max_rows
+        self.max_interval: Optional[float] = max_interval
+        self.max_bytes: Optional[int] = max_bytes
+
+    def should_flush(self, rows: int, nbytes: int, elapsed: float) -> bool:
+        """
+        Check the thresholds.
+
+        Parameters
+        ----------
+
+        rows: int
+            The number of buffered rows.
+        nbytes: int
+            The estimated size of the buffer in bytes.
+        elapsed: float
+            The number of seconds since the previous flush.
+        """
+        if rows == 0:
+            return False
+        return (
+            (self.max_rows is not None and rows >= self.max_rows)
+            or (self.max_bytes is not None and nbytes >= self.max_bytes)
+            or (self.max_interval is not None and elapsed >= self.max_interval)
+        )
+
+
+class BackgroundFlusher:
+    """
+    Drains the buffer of a :py:class:`~dff_node_stats.stats.Stats` instance and passes it to the saver
+    outside of the actor handlers.
+
+    Parameters
+    ----------
+
+    stats: :py:class:`~dff_node_stats.stats.Stats`
+        The stats object to flush.
+    policy: Optional[:py:class:`~dff_node_stats.flush.FlushPolicy`]
+        | Thresholds that trigger the flush. Defaults to the policy of the stats object,
+        | or to 1000 rows or 5 seconds if the stats object has no policy.
+        | If the policy sets no interval, the buffer is still checked every 5 seconds.
+    """
+
+    default_policy = FlushPolicy(max_rows=1000, max_interval=5.0)
+    check_interval: float = 5.0
+
+    def __init__(self, stats, policy: Optional[FlushPolicy] = None) -> None:
+        self.stats = stats
+        self.policy: FlushPolicy = policy or stats.flush_policy or self.default_policy
+        self.flush_count: int = 0
+        self.flushed_rows: int = 0
+        self.failed_flushes: int = 0
+        self.last_flush_latency: float = 0.0
+        self.max_flush_latency: float = 0.0
+        self.total_flush_latency: float = 0.0
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._task_done = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._forced = False
+        self._thread: Optional[threading.Thread] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async_wakeup: Optional[asyncio.Event] = None
+
+    def __deepcopy__(self, *args, **kwargs):
+        return self
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        The number of rows waiting to be flushed.
+        """
+        return len(self.stats.buffer)
+
+    @property
+    def running(self) -> bool:
+        return not self._stopped.is_set() and (self._thread is not None or self._task is not None)
+
+    @property
+    def can_be_awaited(self) -> bool:
+        """
+        Whether the current thread can block until the flusher drains the buffer,
+        i.e. the flusher runs in another thread.
+        """
+        return self.running and self._thread is not None and self._thread is not threading.current_thread()
+
+    @property
+    def counters(self) -> Dict[str, float]:
+        """
+        Queue depth and flush latency counters. Latencies are measured in seconds.
+        """
+        return {
+            "queue_depth": self.queue_depth,
+            "flush_count": self.flush_count,
+            "flushed_rows": self.flushed_rows,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+            "mean_flush_latency": self.total_flush_latency / self.flush_count if self.flush_count else 0.0,
+        }
+
+    def start(self) -> "BackgroundFlusher":
+        """
+        Start flushing in an asyncio task if an event loop is running in the current thread,
+        in a daemon thread otherwise.
+        """
+        if self.running:
+            return self
+        self._stopped.clear()
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+        if self._loop is not None:
+            self._async_wakeup = asyncio.Event()
+            self._task_done.clear()
+            self._task = self._loop.create_task(self._run_async())
+        else:
+            self._thread = threading.Thread(target=self._run, name="dff-stats-flusher", daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    @property
+    def interval(self) -> float:
+        return self.policy.max_interval or self.check_interval
+
+    def notify(self, *args, **kwargs) -> None:
+        """
+        Wake the flusher up if the buffer should be flushed according to the policy.
+        Can be registered as an actor handler.
+        """
+        if self.stats.should_flush(self.policy):
+            self.wake()
+
+    def wake(self, force: bool = False) -> None:
+        """
+        Wake the flusher up regardless of the policy.
+        If `force` is set, the buffer is flushed even if the policy thresholds are not reached.
+        """
+        self._forced = self._forced or force
+        if self._loop is not None and self._async_wakeup is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._async_wakeup.set)
+        self._wakeup.set()
+
+    def flush(self) -> int:
+        """
+        Save the buffered rows synchronously and update the counters.
+        Returns the number of flushed rows.
+        """
+        with self._flush_lock:
+            started = time.perf_counter()
+            try:
+                rows = self.stats.save()
+            except Exception:
+                self.failed_flushes += 1
+                logger.exception("Failed to flush the collected stats")
+                return 0
+            return self._record(rows, started)
+
+    async def aflush(self) -> int:
+        """
+        Await :py:meth:`~dff_node_stats.stats.Stats.asave` and update the counters.
+        Returns the number of flushed rows.
+        """
+        started = time.perf_counter()
+        try:
+            rows = await self.stats.asave()
+        except Exception:
+            self.failed_flushes += 1
+            logger.exception("Failed to flush the collected stats")
+            return 0
+        return self._record(rows, started)
+
+    def _record(self, rows: int, started: float) -> int:
+        if not rows:
+            return 0
+        latency = time.perf_counter() - started
+        self.flush_count += 1
+        self.flushed_rows += rows
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self.total_flush_latency += latency
+        return rows
+
+    def _take_forced(self) -> bool:
+        forced, self._forced = self._forced, False
+        return forced
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._take_forced() or self.stats.should_flush(self.policy):
+                self.flush()
+
+    async def _run_async(self) -> None:
+        try:
+            while not self._stopped.is_set():
+                try:
+                    await asyncio.wait_for(self._async_wakeup.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._async_wakeup.clear()
+                if self._take_forced() or self.stats.should_flush(self.policy):
+                    await self.aflush()
+        finally:
+            self._task_done.set()
+
+    def stop(self) -> None:
+        """
+        | Stop the flusher and save the remaining rows.
+        | The flush in progress, if any, is completed first.
+        | Inside the event loop of the flusher, await :py:meth:`~dff_node_stats.flush.BackgroundFlusher.astop` instead:
+        | the loop cannot complete the flush while it is blocked by this call.
+        """
+        if self._stopped.is_set():
+            return
+        if self._task is not None and self._in_own_loop():
+            raise RuntimeError("The flusher runs in the current event loop, await `astop` instead of calling `stop`")
+        self._stopped.set()
+        self.wake()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._task is not None:
+            if self._loop.is_running():
+                self._task_done.wait()
+            self._task = None
+        atexit.unregister(self.stop)
+        self.flush()
+
+    def _in_own_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    async def astop(self) -> None:
+        """
+        Stop the flusher from inside the event loop and save the remaining rows without blocking it.
+        """
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self.wake()
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+            self._thread = None
+        atexit.unregister(self.stop)
+        await self.aflush()
@@ -0,0 +1,99 @@
+"""
+Aio
+---------------------------
+The async variant of the :py:class:`~dff_node_stats.savers.saver.Saver` interface.
+
+| :py:class:`~dff_node_stats.savers.aio.AsyncSaverMixin` adds the `asave` and `aload` coroutines to the savers.
+| A saver with a native async driver overrides them, the other savers run their blocking methods
+| in a bounded thread pool shared by the process, so the event loop is not blocked by the stats I/O::
+
+    async def handler(...):
+        await saver.asave(dfs)
+        df = await saver.aload(columns=["context_id", "start_time"])
+
+| Use :py:func:`~dff_node_stats.savers.aio.asave` and :py:func:`~dff_node_stats.savers.aio.aload`
+| to await savers that only implement the blocking methods.
+
+"""
+from typing import Any, Callable, Dict, List, Optional, Union
+import asyncio
+import functools
+
+import pandas as pd
+
+from . import pool
+from ..utils import Filters, TimeRange
+
+MAX_WORKERS = 4
+"""
+The number of threads that run the blocking saver calls.
+"""
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """
+    Run a blocking call in the shared executor and await the result.
+    """
+    executor = pool.executor(MAX_WORKERS)
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+class AsyncSaverMixin:
+    """
+    Implements :py:meth:`asave` and :py:meth:`aload` with the blocking `save` and `load` methods of the saver.
+    """
+
+    async def asave(
+        self,
+        dfs: List[pd.DataFrame],
+        column_types: Optional[Dict[str, str]] = None,
+        parse_dates: Union[List[str], bool] = False,
+    ) -> None:
+        """
+        Await :py:meth:`~dff_node_stats.savers.saver.Saver.save` without blocking the event loop.
+        """
+        await run_blocking(self.save, dfs, column_types, parse_dates)
+
+    async def aload(
+        self,
+        column_types: Optional[Dict[str, str]] = None,
+        parse_dates: Union[List[str], bool] = False,
+        columns: Optional[List[str]] = None,
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
+    ) -> pd.DataFrame:
+        """
+        Await :py:meth:`~dff_node_stats.savers.saver.Saver.load` without blocking the event loop.
+        """
+        return await run_blocking(
+            self.load, column_types, parse_dates, columns=columns, time_range=time_range, filters=filters
+        )
+
+
+def is_native(saver, method: str) -> bool:
+    """
+    Check whether the saver implements the async `method` itself rather than with the executor.
+    """
+    func = getattr(saver, method, None)
+    return func is not None and getattr(func, "__func__", None) is not getattr(AsyncSaverMixin, method)
+
+
+async def asave(
+    saver, dfs: List[pd.DataFrame], column_types: Optional[Dict[str, str]] = None, parse_dates=False
+) -> None:
+    """
+    Await `saver.asave`, or run `saver.save` in the shared executor if the saver has no async methods.
+    """
+    if hasattr(saver, "asave"):
+        await saver.asave(dfs, column_types, parse_dates)
+    else:
+        await run_blocking(saver.save, dfs, column_types, parse_dates)
+
+
+async def aload(saver, *args, **kwargs) -> pd.DataFrame:
+    """
+    Await `saver.aload`, or run `saver.load` in the shared executor if the saver has no async methods.
+    """
+    if hasattr(saver, "aload"):
+        return await saver.aload(*args, **kwargs)
+    return await run_blocking(saver.load, *args, **kwargs)
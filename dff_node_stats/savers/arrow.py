@@ -0,0 +1,231 @@
+"""
+Arrow
+---------------------------
+Provides the Arrow IPC version of the :py:class:`~dff_node_stats.savers.saver.Saver`.
+You don't need to interact with this class manually, as it will be automatically
+imported and initialized when you construct :py:class:`~dff_node_stats.savers.saver.Saver` with specific parameters.
+
+| The data is stored in the Arrow IPC stream format: the schema is written once when the file is created,
+| and every flush appends its record batches to the end of the file.
+| The file is memory-mapped on load, so the stats are not read into memory before they are converted
+| to a dataframe, and columns without missing values are converted without copying where pyarrow allows.
+| When a batch does not fit the schema of the file, e.g. a collector was added,
+| a new stream file is started next to the first one (stats.arrow, stats.1.arrow, ...).
+
+"""
+from typing import Dict, Iterator, List, Optional, Union
+import pathlib
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .aio import AsyncSaverMixin
+from ..utils import TIME_COLUMN, Filters, TimeRange, cast_columns, filter_values
+
+
+def _filter_table(
+    table: pa.Table, time_range: Optional[TimeRange] = None, filters: Optional[Filters] = None
+) -> Optional[pa.Table]:
+    """
+    Keep the rows that match the conditions. Returns None if the table lacks a filtered column.
+    """
+    conditions = ([TIME_COLUMN] if time_range is not None else []) + list(filters or {})
+    if any(column not in table.column_names for column in conditions):
+        return None
+    mask = None
+    if time_range is not None:
+        start, end = (pa.scalar(pd.Timestamp(bound), type=table.schema.field(TIME_COLUMN).type) for bound in time_range)
+        mask = pc.and_(pc.greater_equal(table[TIME_COLUMN], start), pc.less_equal(table[TIME_COLUMN], end))
+    for column, value in (filters or {}).items():
+        match = pc.is_in(table[column], value_set=pa.array(filter_values(value), type=table.schema.field(column).type))
+        mask = match if mask is None else pc.and_(mask, match)
+    return table if mask is None else table.filter(mask)
+
+
+class ArrowSaver(AsyncSaverMixin):
+    """
+    Saves and reads the stats dataframe from Arrow IPC stream files.
+    You don't need to interact with this class manually, as it will be automatically
+    initialized when you construct :py:class:`~dff_node_stats.savers.saver.Saver` with specific parameters.
+
+    Parameters
+    ----------
+
+    path: str
+        | The construction path.
+        | The part after :// should contain a path to the stream file.
+
+        >>> ArrowSaver("arrow://foo/stats.arrow")
+    table: str
+        Does not affect the class. Added for constructor uniformity.
+    """
+
+    def __init__(self, path: str, table: str = "dff_stats") -> None:
+        path = path.partition("://")[2]
+        self.path = pathlib.Path(path)
+        self._schema: Optional[pa.Schema] = None
+
+    @property
+    def segments(self) -> List[pathlib.Path]:
+        """
+        The stream files in the order of creation.
+        """
+        numbered = []
+        for path in self.path.parent.glob(f"{self.path.stem}.*{self.path.suffix}"):
+            number = path.name[len(self.path.stem) + 1 : -len(self.path.suffix) or None]
+            if number.isdigit():
+                numbered.append((int(number), path))
+        first = [self.path] if self.path.exists() else []
+        return first + [path for _, path in sorted(numbered)]
+
+    @staticmethod
+    def read_schema(path: pathlib.Path) -> pa.Schema:
+        with pa.memory_map(str(path)) as source:
+            return pa.ipc.open_stream(source).schema
+
+    def save(
+        self,
+        dfs: List[pd.DataFrame],
+        column_types: Optional[Dict[str, str]] = None,
+        parse_dates: Union[List[str], bool] = False,
+    ) -> None:
+        df = pd.concat(dfs, ignore_index=True)
+        segments = self.segments
+        if segments:
+            if self._schema is None:
+                self._schema = self.read_schema(segments[-1])
+            table = self._conform(df, self._schema)
+            if table is not None:
+                self._append(segments[-1], table)
+                return
+        segment = (
+            self.path if not segments else self.path.with_name(f"{self.path.stem}.{len(segments)}{self.path.suffix}")
+        )
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        segment.parent.mkdir(parents=True, exist_ok=True)
+        with open(segment, "wb") as file:
+            file.write(table.schema.serialize())
+        self._schema = table.schema
+        self._append(segment, table)
+
+    @staticmethod
+    def _conform(df: pd.DataFrame, schema: pa.Schema) -> Optional[pa.Table]:
+        """
+        Convert the rows to the schema of an existing file. Returns None if they do not fit.
+        """
+        if not set(df.columns) <= set(schema.names):
+            return None
+        try:
+            return pa.Table.from_pandas(df.reindex(columns=schema.names), schema=schema, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _append(segment: pathlib.Path, table: pa.Table) -> None:
+        payload = b"".join(batch.serialize().to_pybytes() for batch in table.to_batches())
+        with open(segment, "ab") as file:
+            file.write(payload)
+
+    @staticmethod
+    def _to_dataframe(tables: List[pa.Table]) -> pd.DataFrame:
+        if len(tables) == 1:
+            return tables[0].to_pandas(split_blocks=True)
+        try:
+            schema = pa.unify_schemas([table.schema for table in tables])
+        except (pa.ArrowInvalid, pa.ArrowTypeError):  # the segments disagree on a column type
+            return pd.concat([table.to_pandas() for table in tables], ignore_index=True)
+        widened = []
+        for table in tables:
+            for field in schema:
+                if field.name not in table.column_names:
+                    table = table.append_column(field, pa.nulls(table.num_rows, field.type))
+            widened.append(table.select(schema.names))
+        return pa.concat_tables(widened).to_pandas(split_blocks=True)
+
+    def load(
+        self,
+        column_types: Optional[Dict[str, str]] = None,
+        parse_dates: Union[List[str], bool] = False,
+        columns: Optional[List[str]] = None,
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
+    ) -> pd.DataFrame:
+        """
+        | Memory-map the stream files and convert the requested columns to a dataframe.
+        | The time range and the filters are applied to the arrow tables, before the conversion.
+        | If neither `columns` nor `column_types` is set, all columns are read.
+        """
+        columns = list(columns or column_types or [])
+        tables = list(self._read(columns, time_range, filters))
+        if not tables:
+            return pd.DataFrame(columns=columns)
+        df = self._to_dataframe(tables)
+        if columns:
+            df = df.reindex(columns=columns)
+        return cast_columns(df, column_types)
+
+    def iter_load(
+        self,
+        column_types: Optional[Dict[str, str]] = None,
+        parse_dates: Union[List[str], bool] = False,
+        columns: Optional[List[str]] = None,
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
+        chunksize: int = 100000,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        | Convert the memory-mapped record batches to dataframes of at most `chunksize` rows, one chunk at a time.
+        | The conditions are applied to one record batch at a time,
+        | so only the matching rows of the current chunk are copied.
+        """
+        columns = list(columns or column_types or [])
+        for table in self._iter_chunks(columns, time_range, filters, chunksize):
+            df = table.to_pandas(split_blocks=True)
+            yield cast_columns(df.reindex(columns=columns) if columns else df, column_types)
+
+    def _iter_chunks(
+        self,
+        columns: List[str],
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
+        chunksize: int = 100000,
+    ) -> Iterator[pa.Table]:
+        """
+        Filter the record batches of each segment one at a time and regroup the matching rows
+        into tables of `chunksize` rows. A chunk never crosses a segment boundary.
+        """
+        for segment in self.segments:
+            pending: List[pa.Table] = []
+            rows = 0
+            for batch in pa.ipc.open_stream(pa.memory_map(str(segment))):
+                table = _filter_table(pa.Table.from_batches([batch]), time_range, filters)
+                if table is None:
+                    break  # the batches of a segment share the schema
+                if columns:
+                    table = table.select([column for column in columns if column in table.column_names])
+                if not table.num_rows:
+                    continue
+                pending.append(table)
+                rows += table.num_rows
+                if rows >= chunksize:
+                    combined = pa.concat_tables(pending).combine_chunks()
+                    full = rows - rows % chunksize
+                    for start in range(0, full, chunksize):
+                        yield combined.slice(start, chunksize)
+                    pending, rows = [combined.slice(full)], rows - full
+            if rows:
+                yield pa.concat_tables(pending)
+
+    def _read(
+        self, columns: List[str], time_range: Optional[TimeRange] = None, filters: Optional[Filters] = None
+    ) -> Iterator[pa.Table]:
+        for segment in self.segments:
+            # the mapping stays open while the table buffers reference it
+            table = pa.ipc.open_stream(pa.memory_map(str(segment))).read_all()
+            table = _filter_table(table, time_range, filters)
+            if table is None:
+                continue
+            if columns:
+                table = table.select([column for column in columns if column in table.column_names])
+            yield table
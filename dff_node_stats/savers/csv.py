@@ -1,21 +1,35 @@
 """
 CSV
 ---------------------------
-Provides the CSV version of the :py:class:`~dff_node_stats.savers.saver.Saver`. 
-You don't need to interact with this class manually, as it will be automatically 
+Provides the CSV version of the :py:class:`~dff_node_stats.savers.saver.Saver`.
+You don't need to interact with this class manually, as it will be automatically
 initialized when you construct a :py:class:`~dff_node_stats.savers.saver.Saver` with specific parameters.
 
+| The data is stored as a set of segment files next to the target path and a schema manifest::
+
+    stats.csv               # the first segment
+    stats.1.csv             # started when the collected columns changed
+    stats.schema.json       # the columns of each segment
+
+| A segment is only appended to. When a batch contains new columns, a new segment is started,
+| so adding a collector does not rewrite the saved data. Missing columns are filled on load.
+
 """
-from typing import List, Optional, Union, Dict
+from typing import Iterator, List, Optional, Union, Dict
+import csv
+import json
 import pathlib
 import os
 
 import pandas as pd
 
+from .aio import AsyncSaverMixin
+from ..utils import TIME_COLUMN, Filters, TimeRange, cast_columns, filter_dataframe
 
-class CsvSaver:
+
+class CsvSaver(AsyncSaverMixin):
     """
-    Saves and reads the stats dataframe from a csv file.
+    Saves and reads the stats dataframe from a set of csv files.
     You don't need to interact with this class manually, as it will be automatically
     initialized when you construct :py:class:`~dff_node_stats.savers.saver.Saver` with specific parameters.
 
@@ -25,15 +39,66 @@ class CsvSaver:
     path: str
         | The construction path.
         | The part after :// should contain a path to the file that pandas will be able to recognize.
+        | Further segments and the schema manifest are stored in the same directory.
 
         >>> CsvSaver("csv://foo/bar.csv")
     table: str
         Does not affect the class. Added for constructor uniformity.
+    fsync: bool
+        | Whether to call `os.fsync` after each save, so that the saved rows survive a power loss.
+        | Defaults to False: the rows are flushed to the OS, which is enough to survive a process crash.
+
+        >>> Saver("csv://foo/bar.csv", fsync=True)
     """
 
-    def __init__(self, path: str, table: str = "dff_stats") -> None:
+    chunksize: int = 100000
+    """
+    The number of rows read at once when the rows are filtered on load.
+    """
+
+    def __init__(self, path: str, table: str = "dff_stats", fsync: bool = False) -> None:
         path = path.partition("://")[2]
         self.path = pathlib.Path(path)
+        self.manifest_path = self.path.with_name(f"{self.path.stem}.schema.json")
+        self.fsync: bool = fsync
+
+    @staticmethod
+    def read_header(path: pathlib.Path) -> List[str]:
+        """
+        Read the column names from the first line of a csv file.
+        Returns an empty list if the file does not exist or is empty.
+        """
+        if not path.exists() or os.path.getsize(path) == 0:
+            return []
+        with open(path, newline="") as file:
+            return next(csv.reader(file), [])
+
+    @property
+    def segments(self) -> List[Dict[str, list]]:
+        """
+        The segments listed in the schema manifest, in the order of creation.
+        Each segment is a dict with the `file` name and the list of `columns`.
+        A csv file written without a manifest is treated as a single segment.
+        """
+        if self.manifest_path.exists():
+            return json.loads(self.manifest_path.read_text())["segments"]
+        header = self.read_header(self.path)
+        return [{"file": self.path.name, "columns": header}] if header else []
+
+    @property
+    def columns(self) -> List[str]:
+        """
+        The union of the columns of all segments.
+        """
+        columns: Dict[str, None] = {}
+        for segment in self.segments:
+            columns.update(dict.fromkeys(segment["columns"]))
+        return list(columns)
+
+    def _store_segments(self, segments: List[Dict[str, list]]) -> None:
+        temporary = self.manifest_path.with_suffix(".tmp")
+        temporary.write_text(json.dumps({"segments": segments}, indent=2))
+        os.replace(temporary, self.manifest_path)
 
     def save(
         self,
@@ -41,23 +106,100 @@ class CsvSaver:
         column_types: Optional[Dict[str, str]] = None,
         parse_dates: Union[List[str], bool] = False,
     ) -> None:
+        """
+        | Append the rows to the last segment in its column order; missing columns are left empty.
+        | If the rows contain columns that the last segment does not have,
+        | a new segment with the extended header is started instead.
+        """
+        df = pd.concat(dfs, ignore_index=True)
+        segments = self.segments
+        if segments and set(df.columns) <= set(segments[-1]["columns"]):
+            self._append(self.path.with_name(segments[-1]["file"]), df.reindex(columns=segments[-1]["columns"]))
+            return
+        columns = self.columns + [column for column in df.columns if column not in self.columns]
+        name = self.path.name if not segments else f"{self.path.stem}.{len(segments)}{self.path.suffix}"
+        self._append(self.path.with_name(name), df.reindex(columns=columns), header=True)
+        self._store_segments(segments + [{"file": name, "columns": columns}])
 
-        if self.path.exists() and os.path.getsize(self.path) > 0:
-            saved_df = self.load(column_types=column_types, parse_dates=parse_dates)
-        else:
-            saved_df = pd.DataFrame()
-        pd.concat([saved_df] + dfs).to_csv(self.path, index=False)
+    def _append(self, path: pathlib.Path, df: pd.DataFrame, header: bool = False) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w" if header else "a", newline="") as file:
+            df.to_csv(file, index=False, header=header)
+            file.flush()
+            if self.fsync:
+                os.fsync(file.fileno())
 
     def load(
         self,
         column_types: Optional[Dict[str, str]] = None,
         parse_dates: Union[List[str], bool] = False,
+        columns: Optional[List[str]] = None,
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
     ) -> pd.DataFrame:
-        if parse_dates and column_types:
-            true_types = {k: v for k, v in column_types.items() if k in (column_types.keys() - set(parse_dates))}
-        return pd.read_csv(
-            self.path,
-            usecols=column_types.keys(),
-            dtype=true_types,
-            parse_dates=parse_dates,
-        )
+        """
+        | Read the requested columns from every segment and concatenate the results.
+        | Columns that a segment does not have are filled with missing values.
+        | If neither `columns` nor `column_types` is set, all columns are read.
+        | With `time_range` or `filters`, the segments are read in chunks and only the matching rows are kept.
+        """
+        columns = list(columns or column_types or self.columns)
+        parse_dates = parse_dates if isinstance(parse_dates, list) else []
+        frames = list(self._read(columns, column_types, parse_dates, time_range, filters))
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        return cast_columns(df, column_types, parse_dates)
+
+    def iter_load(
+        self,
+        column_types: Optional[Dict[str, str]] = None,
+        parse_dates: Union[List[str], bool] = False,
+        columns: Optional[List[str]] = None,
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
+        chunksize: int = 100000,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        | Read the segments with a chunked `read_csv`. Filtered chunks may be smaller than `chunksize`.
+        """
+        columns = list(columns or column_types or self.columns)
+        parse_dates = parse_dates if isinstance(parse_dates, list) else []
+        for frame in self._read(columns, column_types, parse_dates, time_range, filters, chunksize):
+            yield cast_columns(frame, column_types, parse_dates)
+
+    def _read(
+        self,
+        columns: List[str],
+        column_types: Optional[Dict[str, str]],
+        parse_dates: List[str],
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
+        chunksize: Optional[int] = None,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        | Read the segments one after another. The conditions are applied to every chunk of `chunksize` rows.
+        | Without a chunk size, a segment without conditions is read at once.
+        """
+        conditions = ([TIME_COLUMN] if time_range is not None else []) + list(filters or {})
+        if conditions and chunksize is None:
+            chunksize = self.chunksize
+        for segment in self.segments:
+            if any(column not in segment["columns"] for column in conditions):
+                continue  # a segment without a filtered column has no matching rows
+            present = [column for column in columns if column in segment["columns"]]
+            usecols = present + [column for column in conditions if column not in present]
+            # only text columns are typed on read: the other columns of a segment may have missing values
+            dtype = {k: v for k, v in (column_types or {}).items() if v in ("str", "object") and k in usecols}
+            dates = [column for column in parse_dates if column in usecols]
+            if time_range is not None and TIME_COLUMN not in dates:
+                dates.append(TIME_COLUMN)
+            path = self.path.with_name(segment["file"])
+            if chunksize is None:
+                yield pd.read_csv(path, usecols=usecols, dtype=dtype, parse_dates=dates).reindex(columns=columns)
+                continue
+            for frame in pd.read_csv(path, usecols=usecols, dtype=dtype, parse_dates=dates, chunksize=chunksize):
+                if conditions:
+                    frame = filter_dataframe(frame, time_range, filters)
+                if len(frame):
+                    yield frame.reindex(columns=columns)
@@ -0,0 +1,261 @@
+"""
+Parquet
+---------------------------
+Provides the Parquet version of the :py:class:`~dff_node_stats.savers.saver.Saver`.
+You don't need to interact with this class manually, as it will be automatically
+imported and initialized when you construct :py:class:`~dff_node_stats.savers.saver.Saver` with specific parameters.
+
+| The data is stored as a Hive-style dataset partitioned by the date of the `start_time` column::
+
+    stats/
+        date=2022-05-30/
+            part-<uuid>.parquet     # one file per flush
+        date=2022-05-31/
+            ...
+        date=__HIVE_DEFAULT_PARTITION__/
+            ...                     # the rows without a start time
+
+| Every flush writes a new file to each affected partition, so the saved data is never rewritten.
+| The columns are written with the arrow types of the collector column types, so the files of different flushes agree.
+| Files with different columns can coexist: the missing columns are filled on load.
+| Files that disagree on a column type, e.g. written by an older version, are read separately and concatenated.
+
+"""
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+import json
+import pathlib
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .aio import AsyncSaverMixin
+from ..utils import Filters, TimeRange, cast_columns, filter_values
+
+PARTITION = "date"
+PARTITION_COLUMN = "start_time"
+DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+ARROW_TYPES: Dict[str, pa.DataType] = {
+    "str": pa.string(),
+    "object": pa.string(),
+    "int64": pa.int64(),
+    "float64": pa.float64(),
+    "bool": pa.bool_(),
+    "datetime64[ns]": pa.timestamp("ns"),
+}
+"""
+The arrow types of the collector column types.
+"""
+
+
+def _as_text(value: Any) -> Optional[str]:
+    if isinstance(value, str) or value is None:
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return None if pd.isna(value) else str(value)
+
+
+class ParquetSaver(AsyncSaverMixin):
+    """
+    Saves and reads the stats dataframe from a date-partitioned parquet dataset.
+    You don't need to interact with this class manually, as it will be automatically
+    initialized when you construct :py:class:`~dff_node_stats.savers.saver.Saver` with specific parameters.
+
+    Parameters
+    ----------
+
+    path: str
+        | The construction path.
+        | The part after :// should contain a path to the dataset directory.
+
+        >>> ParquetSaver("parquet://foo/stats")
+    table: str
+        Does not affect the class. Added for constructor uniformity.
+    compression: str
+        The parquet compression codec. Defaults to "zstd".
+    """
+
+    dictionary_columns: List[str] = ["flow_label", "node_label"]
+    """
+    Low-cardinality columns that are dictionary-encoded in the files.
+    """
+
+    def __init__(self, path: str, table: str = "dff_stats", compression: str = "zstd") -> None:
+        path = path.partition("://")[2]
+        self.path = pathlib.Path(path)
+        self.compression: str = compression
+
+    def partitions(self, time_range: Optional[TimeRange] = None) -> List[pathlib.Path]:
+        """
+        | The partition directories, optionally limited to the dates of the `time_range` bounds.
+        | The partition of the rows without a start time never matches a time range.
+        """
+        partitions = sorted(self.path.glob(f"{PARTITION}=*"))
+        if time_range is None:
+            return partitions
+        start, end = (pd.Timestamp(bound).strftime("%Y-%m-%d") for bound in time_range)
+        dates = [(partition, partition.name.partition("=")[2]) for partition in partitions]
+        return [partition for partition, date in dates if date != DEFAULT_PARTITION and start <= date <= end]
+
+    def save(
+        self,
+        dfs: List[pd.DataFrame],
+        column_types: Optional[Dict[str, str]] = None,
+        parse_dates: Union[List[str], bool] = False,
+    ) -> None:
+        df = pd.concat(dfs, ignore_index=True)
+        if PARTITION_COLUMN in df.columns:
+            dates = pd.to_datetime(df[PARTITION_COLUMN]).dt.strftime("%Y-%m-%d").fillna(DEFAULT_PARTITION)
+        else:
+            dates = pd.Series(DEFAULT_PARTITION, index=df.index)
+        schema = self._write_schema(df, column_types)
+        name = f"part-{uuid.uuid4().hex}.parquet"
+        for date, partition_df in df.groupby(dates, sort=False):
+            try:
+                table = pa.Table.from_pandas(partition_df, schema=schema, preserve_index=False)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):  # the values do not match the declared types
+                table = pa.Table.from_pandas(partition_df, preserve_index=False)
+            partition = self.path / f"{PARTITION}={date}"
+            partition.mkdir(parents=True, exist_ok=True)
+            pq.write_table(
+                table,
+                partition / name,
+                compression=self.compression,
+                use_dictionary=[column for column in self.dictionary_columns if column in table.column_names],
+                row_group_size=len(partition_df),
+            )
+
+    @staticmethod
+    def _write_schema(df: pd.DataFrame, column_types: Optional[Dict[str, str]] = None) -> pa.Schema:
+        """
+        | The schema of the written files: the arrow types of `column_types`, inferred for the other columns.
+        | The values of the text columns are converted to strings in place, dict and list values to json.
+        """
+        column_types = column_types or {}
+        for column in df.columns:
+            if column_types.get(column) in ("str", "object"):
+                df[column] = df[column].map(_as_text)
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+        fields = [
+            field.with_type(ARROW_TYPES[column_types[field.name]])
+            if column_types.get(field.name) in ARROW_TYPES
+            else field
+            for field in schema
+        ]
+        return pa.schema(fields, metadata=schema.metadata)
+
+    def load(
+        self,
+        column_types: Optional[Dict[str, str]] = None,
+        parse_dates: Union[List[str], bool] = False,
+        columns: Optional[List[str]] = None,
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
+    ) -> pd.DataFrame:
+        """
+        | Read the requested columns from the dataset. Only the file footers are read to find the schema.
+        | The `time_range` selects the partitions to read. The time range and the filters are pushed down
+        | to the parquet reader, which skips the row groups whose statistics do not match.
+        | If neither `columns` nor `column_types` is set, all columns are read.
+        """
+        columns = list(columns or column_types or [])
+        tables = [scan.to_table() for scan in self._scan(columns, time_range, filters)]
+        if not tables:
+            return pd.DataFrame(columns=columns)
+        if len(tables) == 1:
+            df = tables[0].to_pandas()
+        else:  # the files disagree on a column type
+            df = pd.concat([table.to_pandas() for table in tables], ignore_index=True)
+        if columns:
+            df = df.reindex(columns=columns)
+        return cast_columns(df, column_types)
+
+    def iter_load(
+        self,
+        column_types: Optional[Dict[str, str]] = None,
+        parse_dates: Union[List[str], bool] = False,
+        columns: Optional[List[str]] = None,
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
+        chunksize: int = 100000,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        | Convert the record batches of the dataset scan one at a time.
+        | A batch never crosses a file boundary, so chunks may be smaller than `chunksize`.
+        """
+        columns = list(columns or column_types or [])
+        for scan in self._scan(columns, time_range, filters, chunksize):
+            for batch in scan.to_batches():
+                if batch.num_rows:
+                    df = batch.to_pandas()
+                    yield cast_columns(df.reindex(columns=columns) if columns else df, column_types)
+
+    def _scan(
+        self,
+        columns: List[str],
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
+        chunksize: Optional[int] = None,
+    ) -> List[ds.Scanner]:
+        """
+        | Build the scanners of the matching files, columns and rows.
+        | There is one scanner for all files, unless they disagree on a column type:
+        | then the files are grouped by their schema, one scanner per group.
+        """
+        files = [str(file) for partition in self.partitions(time_range) for file in sorted(partition.glob("*.parquet"))]
+        schemas = [pq.read_schema(file) for file in files]
+        try:
+            groups = [(pa.unify_schemas(schemas), files)] if files else []
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            groups = self._group_by_schema(files, schemas)
+        scanners = [self._scanner(schema, files, columns, time_range, filters, chunksize) for schema, files in groups]
+        return [scanner for scanner in scanners if scanner is not None]
+
+    @staticmethod
+    def _group_by_schema(files: List[str], schemas: List[pa.Schema]) -> List[Tuple[pa.Schema, List[str]]]:
+        """
+        Put each file into the first group whose schema it can be unified with.
+        """
+        groups: List[Tuple[pa.Schema, List[str]]] = []
+        for file, schema in zip(files, schemas):
+            for index, (group_schema, group_files) in enumerate(groups):
+                try:
+                    groups[index] = (pa.unify_schemas([group_schema, schema]), group_files + [file])
+                    break
+                except (pa.ArrowInvalid, pa.ArrowTypeError):
+                    continue
+            else:
+                groups.append((schema, [file]))
+        return groups
+
+    @staticmethod
+    def _scanner(
+        schema: pa.Schema,
+        files: List[str],
+        columns: List[str],
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
+        chunksize: Optional[int] = None,
+    ) -> Optional[ds.Scanner]:
+        """
+        Build the scanner of `files` with the common `schema`. Returns None if no rows can match.
+        """
+        conditions = ([PARTITION_COLUMN] if time_range is not None else []) + list(filters or {})
+        if any(column not in schema.names for column in conditions):
+            return None
+        dataset = ds.dataset(files, schema=schema, format="parquet")
+        condition = None
+        if time_range is not None:
+            start, end = (
+                pa.scalar(pd.Timestamp(bound), type=schema.field(PARTITION_COLUMN).type) for bound in time_range
+            )
+            condition = (ds.field(PARTITION_COLUMN) >= start) & (ds.field(PARTITION_COLUMN) <= end)
+        for column, value in (filters or {}).items():
+            match = ds.field(column).isin(pa.array(filter_values(value), type=schema.field(column).type))
+            condition = match if condition is None else condition & match
+        present = [column for column in columns if column in schema.names] if columns else None
+        options = {} if chunksize is None else {"batch_size": chunksize}
+        return dataset.scanner(columns=present, filter=condition, **options)
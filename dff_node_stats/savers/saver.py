@@ -7,20 +7,26 @@ On the other hand, it is also used to automatically construct the child classes
 depending on the input parameters. See the class documentation for more info.
 
 """
-from typing import Dict, List, Union, Optional
+from typing import Dict, Iterator, List, Union, Optional
 import pathlib
 import importlib
 
 import pandas as pd
 
+from .aio import AsyncSaverMixin
+from ..utils import Filters, TimeRange
 
-class Saver:
+
+class Saver(AsyncSaverMixin):
     """
     :py:class:`~dff_node_stats.savers.saver.Saver` interface requires two methods to be impemented:
 
     #. :py:meth:`~dff_node_stats.savers.saver.Saver.save`
     #. :py:meth:`~dff_node_stats.savers.saver.Saver.load`
 
+    | The async `asave` and `aload` methods of :py:class:`~dff_node_stats.savers.aio.AsyncSaverMixin`
+    | run them in a thread pool. Override the async methods if the storage has a native async driver.
+
     | A call to Saver is needed to instantiate one of the predefined child classes.
     | The subclass is chosen depending on the `path` parameter value (see Parameters).
 
@@ -44,6 +50,8 @@ class Saver:
 
     table: str
         Sets the name of the db table to use, if necessary. Defaults to "dff_stats".
+    kwargs:
+        Backend-specific options, passed to the constructor of the child class.
     """
 
     _saver_mapping = {}
@@ -52,7 +60,7 @@ class Saver:
         super().__init_subclass__(**kwargs)
         cls._saver_mapping[storage_type] = cls.__name__
 
-    def __new__(cls, path: Optional[str] = None, table: str = "dff_stats"):
+    def __new__(cls, path: Optional[str] = None, table: str = "dff_stats", **kwargs):
         if not path:
             raise ValueError(
                 """
@@ -86,7 +94,7 @@ class Saver:
             subclass_name,
         )
         obj = object.__new__(subclass)
-        obj.__init__(str(path), table)
+        obj.__init__(str(path), table, **kwargs)
         return obj
 
     def save(
@@ -112,18 +120,58 @@ class Saver:
         self,
         column_types: Optional[Dict[str, str]] = None,
         parse_dates: Union[List[str], bool] = False,
+        columns: Optional[List[str]] = None,
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
     ) -> pd.DataFrame:
         """
         Load the data from a database or a file.
+        The column subset, the time range and the filters are applied by the storage where possible,
+        so that only the matching rows are read.
 
         Parameters
         ----------
 
         column_types: Optional[Dict[str, str]] = None
         parse_dates: Union[List[str], bool] = False
+        columns: Optional[List[str]] = None
+            | The columns to read. Defaults to the keys of `column_types`, or to all saved columns.
+            | Requested columns that were never saved are filled with missing values.
+        time_range: Optional[:py:const:`~dff_node_stats.utils.TimeRange`] = None
+            Inclusive bounds of the `start_time` column.
+        filters: Optional[:py:const:`~dff_node_stats.utils.Filters`] = None
+            | Equality conditions, e.g. `{"context_id": "..."}` or `{"flow_label": ["root", "greeting"]}`.
         """
         raise NotImplementedError
 
+    def iter_load(
+        self,
+        column_types: Optional[Dict[str, str]] = None,
+        parse_dates: Union[List[str], bool] = False,
+        columns: Optional[List[str]] = None,
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
+        chunksize: int = 100000,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        | Load the data in chunks of at most `chunksize` rows.
+        | Only one chunk is held in memory at a time, so the saved data may be larger than the available memory.
+        | The other parameters are the same as in :py:meth:`~dff_node_stats.savers.saver.Saver.load`.
+
+        Parameters
+        ----------
+
+        chunksize: int = 100000
+            The maximum number of rows in a chunk.
+        """
+        raise NotImplementedError
+
+
+class ArrowSaver(Saver, storage_type="arrow"):
+    """ArrowSaver Class prototype"""
+
+    pass
+
 
 class ClickHouseSaver(Saver, storage_type="clickhouse"):
     """ClickHouseSaver Class prototype"""
@@ -137,7 +185,25 @@ class CsvSaver(Saver, storage_type="csv"):
     pass
 
 
+class ParquetSaver(Saver, storage_type="parquet"):
+    """ParquetSaver Class prototype"""
+
+    pass
+
+
 class PostgresSaver(Saver, storage_type="postgresql"):
     """PostgresSaver Class prototype"""
 
     pass
+
+
+class SqliteSaver(Saver, storage_type="sqlite"):
+    """SqliteSaver Class prototype"""
+
+    pass
+
+
+class SpoolSaver(Saver, storage_type="spool"):
+    """SpoolSaver Class prototype"""
+
+    pass
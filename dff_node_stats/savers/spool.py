@@ -0,0 +1,244 @@
+"""
+Spool
+---------------------------
+Provides the spool version of the :py:class:`~dff_node_stats.savers.saver.Saver`
+and the :py:class:`~dff_node_stats.savers.spool.SpoolAggregator` class.
+
+| Use the spool saver when the bot runs in several worker processes.
+| Each process appends the flushed batches to its own segment files in a shared directory,
+| and a single aggregator process moves them to the target storage in large batches::
+
+    # in every worker process
+    stats = Stats(saver=Saver("spool://var/stats_spool"))
+
+    # in the aggregator process
+    SpoolAggregator("spool://var/stats_spool", Saver("csv://stats.csv")).run(interval=5.0)
+
+| The batches are pickled, so the spool directory should only be writable by trusted processes.
+
+"""
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import json
+import os
+import pathlib
+import pickle
+import socket
+import struct
+import threading
+import time
+
+import pandas as pd
+
+from .aio import AsyncSaverMixin
+from ..utils import Filters, TimeRange, filter_dataframe
+
+HEADER = struct.Struct(">I")
+SUFFIX = ".spool"
+OFFSETS_FILE = ".offsets.json"
+
+
+def _segment_key(path: pathlib.Path) -> Tuple[str, int]:
+    writer, _, sequence = path.stem.rpartition("-")
+    return writer, int(sequence)
+
+
+def read_batches(path: pathlib.Path, offset: int = 0) -> Iterator[Tuple[int, tuple]]:
+    """
+    Read the complete batches of a segment file starting from `offset`.
+    Yields the offset after each batch together with the batch.
+    An incomplete batch at the end of the file is left for the next read.
+    """
+    with open(path, "rb") as file:
+        file.seek(offset)
+        while True:
+            header = file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            (size,) = HEADER.unpack(header)
+            payload = file.read(size)
+            if len(payload) < size:
+                return
+            offset += HEADER.size + size
+            yield offset, pickle.loads(payload)
+
+
+class SpoolSaver(AsyncSaverMixin):
+    """
+    Appends the stats batches to segment files of the current process in a spool directory.
+    You don't need to interact with this class manually, as it will be automatically
+    initialized when you construct :py:class:`~dff_node_stats.savers.saver.Saver` with specific parameters.
+
+    Parameters
+    ----------
+
+    path: str
+        | The construction path.
+        | The part after :// should contain a path to the spool directory.
+
+        >>> SpoolSaver("spool://var/stats_spool")
+    table: str
+        Does not affect the class. Added for constructor uniformity.
+    """
+
+    max_segment_bytes: int = 64 * 1024 * 1024
+    """
+    The segment size after which the process starts a new segment file.
+    """
+
+    def __init__(self, path: str, table: str = "dff_stats") -> None:
+        path = path.partition("://")[2]
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._segment: Optional[pathlib.Path] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def segment(self) -> pathlib.Path:
+        """
+        The segment file that the current process appends to.
+        A new segment is started after a fork or when the current one grows larger than `max_segment_bytes`.
+        """
+        pid = os.getpid()
+        if self._segment is None or self._pid != pid:
+            self._pid = pid
+            self._segment = self._next_segment(f"{socket.gethostname()}-{pid}")
+        elif self._segment.exists() and self._segment.stat().st_size >= self.max_segment_bytes:
+            self._segment = self._next_segment(_segment_key(self._segment)[0])
+        return self._segment
+
+    def _next_segment(self, writer: str) -> pathlib.Path:
+        existing = [_segment_key(path)[1] for path in self.path.glob(f"{writer}-*{SUFFIX}")]
+        sequence = max(existing, default=-1) + 1
+        return self.path / f"{writer}-{sequence:06d}{SUFFIX}"
+
+    def save(
+        self,
+        dfs: List[pd.DataFrame],
+        column_types: Optional[Dict[str, str]] = None,
+        parse_dates: Union[List[str], bool] = False,
+    ) -> None:
+        df = pd.concat(dfs, ignore_index=True)
+        payload = pickle.dumps((column_types, parse_dates, df), protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock, open(self.segment, "ab") as file:
+            file.write(HEADER.pack(len(payload)) + payload)
+
+    def load(
+        self,
+        column_types: Optional[Dict[str, str]] = None,
+        parse_dates: Union[List[str], bool] = False,
+        columns: Optional[List[str]] = None,
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
+    ) -> pd.DataFrame:
+        """
+        | Read the batches that have not been aggregated yet. The spool is meant to be short-lived,
+        | so the conditions are applied after the batches are read.
+        """
+        columns = list(columns or column_types or [])
+        frames = [batch[2] for path in sorted(self.path.glob(f"*{SUFFIX}")) for _, batch in read_batches(path)]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        df = filter_dataframe(pd.concat(frames, ignore_index=True), time_range, filters)
+        return df.reindex(columns=columns) if columns else df
+
+    def iter_load(
+        self,
+        column_types: Optional[Dict[str, str]] = None,
+        parse_dates: Union[List[str], bool] = False,
+        columns: Optional[List[str]] = None,
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
+        chunksize: int = 100000,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        | Read the spooled batches one at a time and split them into chunks of at most `chunksize` rows.
+        """
+        columns = list(columns or column_types or [])
+        for path in sorted(self.path.glob(f"*{SUFFIX}")):
+            for _, (_, _, df) in read_batches(path):
+                df = filter_dataframe(df, time_range, filters)
+                df = df.reindex(columns=columns) if columns else df
+                for start in range(0, len(df), chunksize):
+                    yield df.iloc[start : start + chunksize].reset_index(drop=True)
+
+
+class SpoolAggregator:
+    """
+    | Moves the batches from a spool directory to the target saver.
+    | Every call to :py:meth:`~dff_node_stats.savers.spool.SpoolAggregator.run_once` collects
+    | all complete batches written since the previous call and saves them at once.
+    | Read offsets are stored in the spool directory after the target saver succeeds,
+    | so a batch is never lost, but may be saved twice if the aggregator crashes in between.
+    | Segments that have been read completely and have a newer segment from the same process are removed.
+
+    Parameters
+    ----------
+
+    path: str
+        The spool directory, optionally prefixed with spool://.
+    saver: :py:class:`~dff_node_stats.savers.Saver`
+        The target saver.
+    """
+
+    def __init__(self, path: str, saver) -> None:
+        self.path = pathlib.Path(path.partition("://")[2] if "://" in path else path)
+        self.saver = saver
+        self.offsets_file = self.path / OFFSETS_FILE
+        self.aggregated_rows: int = 0
+
+    def _load_offsets(self) -> Dict[str, int]:
+        if not self.offsets_file.exists():
+            return {}
+        return json.loads(self.offsets_file.read_text())
+
+    def _store_offsets(self, offsets: Dict[str, int]) -> None:
+        temporary = self.offsets_file.with_suffix(".tmp")
+        temporary.write_text(json.dumps(offsets))
+        os.replace(temporary, self.offsets_file)
+
+    def run_once(self) -> int:
+        """
+        Save the new batches to the target saver. Returns the number of saved rows.
+        """
+        offsets = self._load_offsets()
+        segments = sorted(self.path.glob(f"*{SUFFIX}"), key=_segment_key)
+        frames: List[pd.DataFrame] = []
+        column_types: Dict[str, str] = {}
+        parse_dates: List[str] = []
+        for segment in segments:
+            for offset, (batch_types, batch_dates, df) in read_batches(segment, offsets.get(segment.name, 0)):
+                offsets[segment.name] = offset
+                frames.append(df)
+                column_types.update(batch_types or {})
+                parse_dates.extend(date for date in batch_dates or [] if date not in parse_dates)
+
+        rows = sum(len(df) for df in frames)
+        if rows:
+            self.saver.save(frames, column_types=column_types, parse_dates=parse_dates)
+            self.aggregated_rows += rows
+        self._remove_finished(segments, offsets)
+        self._store_offsets(offsets)
+        return rows
+
+    def _remove_finished(self, segments: List[pathlib.Path], offsets: Dict[str, int]) -> None:
+        latest: Dict[str, int] = {}
+        for segment in segments:
+            writer, sequence = _segment_key(segment)
+            latest[writer] = max(latest.get(writer, sequence), sequence)
+        for segment in segments:
+            writer, sequence = _segment_key(segment)
+            if sequence < latest[writer] and offsets.get(segment.name, 0) >= segment.stat().st_size:
+                segment.unlink()
+                offsets.pop(segment.name, None)
+
+    def run(self, interval: float = 5.0, stop_event: Optional[threading.Event] = None) -> None:
+        """
+        Aggregate the spool every `interval` seconds until `stop_event` is set.
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            started = time.monotonic()
+            self.run_once()
+            stop_event.wait(max(0.0, interval - (time.monotonic() - started)))
+        self.run_once()
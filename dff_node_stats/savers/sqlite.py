@@ -0,0 +1,206 @@
+"""
+SQLite
+---------------------------
+Provides the SQLite version of the :py:class:`~dff_node_stats.savers.saver.Saver`.
+You don't need to interact with this class manually, as it will be automatically
+imported and initialized when you construct :py:class:`~dff_node_stats.savers.saver.Saver` with specific parameters.
+
+| The database uses write-ahead logging, so the dashboards can read the stats while the bot is writing them.
+| Each flush is inserted with a single prepared statement in one transaction.
+| New columns are added with `ALTER TABLE ADD COLUMN`, the saved rows are never rewritten.
+
+"""
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import json
+import pathlib
+import sqlite3
+import threading
+
+import pandas as pd
+
+from .aio import AsyncSaverMixin
+from ..utils import TIME_COLUMN, Filters, TimeRange, cast_columns, filter_values
+
+INDEXED_COLUMNS = ["context_id", "start_time"]
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def _quote(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _sql_type(dtype: str) -> str:
+    dtype = str(dtype)
+    if dtype.startswith(("int", "uint", "bool")):
+        return "INTEGER"
+    if dtype.startswith("float"):
+        return "REAL"
+    return "TEXT"
+
+
+class SqliteSaver(AsyncSaverMixin):
+    """
+    Saves and reads the stats dataframe from a SQLite database.
+    You don't need to interact with this class manually, as it will be automatically
+    initialized when you construct :py:class:`~dff_node_stats.savers.saver.Saver` with specific parameters.
+
+    Parameters
+    ----------
+
+    path: str
+        | The construction path.
+        | The part after :// should contain a path to the database file.
+
+        >>> SqliteSaver("sqlite://foo/stats.db")
+    table: str
+        Sets the name of the db table to use. Defaults to "dff_stats".
+    """
+
+    def __init__(self, path: str, table: str = "dff_stats") -> None:
+        path = path.partition("://")[2]
+        self.path = pathlib.Path(path)
+        self.table: str = table
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        The connection shared by the threads of the process. Access it under the saver lock.
+        """
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+        return self._connection
+
+    def _existing_columns(self, connection: Optional[sqlite3.Connection] = None) -> List[str]:
+        connection = connection or self.connection
+        return [row[1] for row in connection.execute(f"PRAGMA table_info({_quote(self.table)})")]
+
+    def _migrate(self, df: pd.DataFrame, column_types: Dict[str, str]) -> None:
+        types = {column: column_types.get(column) or df[column].dtype for column in df.columns}
+        existing = self._existing_columns()
+        if not existing:
+            definition = ", ".join(f"{_quote(column)} {_sql_type(dtype)}" for column, dtype in types.items())
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {_quote(self.table)} ({definition})")
+        else:
+            for column in df.columns:
+                if column not in existing:
+                    self.connection.execute(
+                        f"ALTER TABLE {_quote(self.table)} ADD COLUMN {_quote(column)} {_sql_type(types[column])}"
+                    )
+        for column in INDEXED_COLUMNS:
+            if column in df.columns:
+                self.connection.execute(
+                    "CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(
+                        _quote(f"{self.table}_{column}"), _quote(self.table), _quote(column)
+                    )
+                )
+
+    @staticmethod
+    def _records(df: pd.DataFrame) -> List[tuple]:
+        """
+        Convert the rows to sqlite values. Datetimes are formatted, dict and list values are serialized to json.
+        """
+        df = df.copy()
+        for column in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[column]):
+                df[column] = df[column].dt.strftime(TIME_FORMAT)
+            elif df[column].dtype == object:
+                df[column] = df[column].map(
+                    lambda value: json.dumps(value) if isinstance(value, (dict, list)) else value
+                )
+        df = df.astype(object).where(df.notna(), None)
+        return list(df.itertuples(index=False, name=None))
+
+    def save(
+        self,
+        dfs: List[pd.DataFrame],
+        column_types: Optional[Dict[str, str]] = None,
+        parse_dates: Union[List[str], bool] = False,
+    ) -> None:
+        df = pd.concat(dfs, ignore_index=True)
+        columns = ", ".join(map(_quote, df.columns))
+        placeholders = ", ".join("?" * len(df.columns))
+        statement = f"INSERT INTO {_quote(self.table)} ({columns}) VALUES ({placeholders})"
+        records = self._records(df)
+        with self._lock, self.connection:
+            self._migrate(df, column_types or {})
+            self.connection.executemany(statement, records)
+
+    def load(
+        self,
+        column_types: Optional[Dict[str, str]] = None,
+        parse_dates: Union[List[str], bool] = False,
+        columns: Optional[List[str]] = None,
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
+    ) -> pd.DataFrame:
+        """
+        | Read the requested columns of the matching rows. The conditions are passed to SQLite as query parameters.
+        | Columns that the table does not have are filled with missing values.
+        | If neither `columns` nor `column_types` is set, all columns are read.
+        """
+        with self._lock:
+            existing = self._existing_columns()
+            columns = list(columns or column_types or existing)
+            present = [column for column in columns if column in existing]
+            conditions = ([TIME_COLUMN] if time_range is not None else []) + list(filters or {})
+            if not present or any(column not in existing for column in conditions):
+                return pd.DataFrame(columns=columns)
+            parse_dates = (
+                [column for column in parse_dates if column in present] if isinstance(parse_dates, list) else []
+            )
+            query, params = self._select(present, time_range, filters)
+            df = pd.read_sql_query(query, self.connection, params=params, parse_dates=parse_dates)
+        return cast_columns(df.reindex(columns=columns), column_types, parse_dates)
+
+    def iter_load(
+        self,
+        column_types: Optional[Dict[str, str]] = None,
+        parse_dates: Union[List[str], bool] = False,
+        columns: Optional[List[str]] = None,
+        time_range: Optional[TimeRange] = None,
+        filters: Optional[Filters] = None,
+        chunksize: int = 100000,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        | Fetch the matching rows from a cursor `chunksize` rows at a time.
+        | The iterator uses its own connection, so the saver can keep writing while the data is read.
+        """
+        if not self.path.exists():
+            return
+        connection = sqlite3.connect(self.path)
+        try:
+            existing = self._existing_columns(connection)
+            columns = list(columns or column_types or existing)
+            present = [column for column in columns if column in existing]
+            conditions = ([TIME_COLUMN] if time_range is not None else []) + list(filters or {})
+            if not present or any(column not in existing for column in conditions):
+                return
+            parse_dates = (
+                [column for column in parse_dates if column in present] if isinstance(parse_dates, list) else []
+            )
+            query, params = self._select(present, time_range, filters)
+            for df in pd.read_sql_query(query, connection, params=params, parse_dates=parse_dates, chunksize=chunksize):
+                yield cast_columns(df.reindex(columns=columns), column_types, parse_dates)
+        finally:
+            connection.close()
+
+    def _select(
+        self, columns: List[str], time_range: Optional[TimeRange] = None, filters: Optional[Filters] = None
+    ) -> Tuple[str, list]:
+        query = "SELECT {} FROM {}".format(", ".join(map(_quote, columns)), _quote(self.table))
+        where, params = [], []
+        if time_range is not None:
+            where.append(f"{_quote(TIME_COLUMN)} BETWEEN ? AND ?")
+            params.extend(pd.Timestamp(bound).strftime(TIME_FORMAT) for bound in time_range)
+        for column, value in (filters or {}).items():
+            values = filter_values(value)
+            where.append("{} IN ({})".format(_quote(column), ", ".join("?" * len(values))))
+            params.extend(values)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        return query, params
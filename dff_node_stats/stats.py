@@ -12,9 +12,24 @@ Example::
 
     stats.update_actor_handlers(actor, auto_save=False)
 
+| Pass a :py:class:`~dff_node_stats.flush.FlushPolicy` to save the data in batches instead of every turn.
+| Pass `background=True` to save the data in a :py:class:`~dff_node_stats.flush.BackgroundFlusher`
+| instead of the actor turn. Remaining rows are saved on :py:meth:`~dff_node_stats.stats.Stats.close`.
+| Inside an event loop, await :py:meth:`~dff_node_stats.stats.Stats.asave`
+| and :py:meth:`~dff_node_stats.stats.Stats.aclose` instead.
+| Call :py:meth:`~dff_node_stats.stats.Stats.refresh` to append the newly saved rows to the loaded dataframe.
+
 """
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+import asyncio
 import datetime
+import inspect
+import os
+import pathlib
+import threading
+import time
+import uuid
+import zlib
 from functools import cached_property
 from copy import copy
 
@@ -24,7 +39,23 @@ from df_engine.core import Context, Actor
 from df_engine.core.types import ActorStage
 
 from . import collectors as DSC
-from .savers import Saver
+from .buffer import BufferLimit, ColumnarBuffer, Overflow, ShardedBuffer
+from .flush import BackgroundFlusher, FlushPolicy
+from .savers import Saver, aio
+from .savers.spool import SpoolSaver, read_batches
+from .utils import TIME_COLUMN, BoundedDict
+
+
+def _row_keys(df: pd.DataFrame, columns: List[str]) -> pd.Series:
+    """
+    | Identify the rows by their values in `columns`. Equal rows are numbered to tell them apart.
+    | Numbers are compared as floats: an integer column is loaded as float if it has missing values.
+    """
+    values = df[columns].apply(
+        lambda column: column.astype("float64") if pd.api.types.is_numeric_dtype(column) else column
+    )
+    hashes = pd.util.hash_pandas_object(values.astype(str), index=False)
+    return hashes.astype(str) + ":" + hashes.groupby(hashes).cumcount().astype(str)
 
 
 class Stats:
@@ -41,65 +72,459 @@ class Stats:
         Instances of the :py:class:`~dff_node_stats.collectors.Collector` class.
         Their method :py:meth:`~dff_node_stats.collectors.Collector.collect_stats`
         is invoked each turn of the :py:class:`~df_engine.core.actor.Actor` to save the desired information.
+        Turn start times are tracked per context id and passed to the collectors
+        as `start_time` (wall clock) and `start_ns` (:py:func:`time.perf_counter_ns`).
+    flush_policy: Optional[:py:class:`~dff_node_stats.flush.FlushPolicy`]
+        Thresholds that define when the automatically saved data is flushed.
+        By default, the data is saved on every turn.
+    concurrent: bool
+        | Collect the data into a separate buffer for each thread.
+        | Use this mode if the actors that share the instance run in several threads.
+    trusted: bool
+        | Validate the actor once in :py:meth:`~dff_node_stats.stats.Stats.update_actor_handlers`
+        | and skip the per-turn validation of the handler and collector arguments.
+        | Use this mode if the handlers are only called by the registered actor.
+    sample_rate: Optional[float]
+        | The share of dialogs to collect, from 0 to 1. The decision is made once per context id
+        | with a deterministic hash, so a dialog is either collected completely or skipped completely.
+        | The handlers return immediately for skipped dialogs.
+        | If set, the rate is saved to the `sample_rate` column of each row to re-weight the aggregates.
+    buffer_limit: Optional[:py:class:`~dff_node_stats.buffer.BufferLimit`]
+        | Caps the buffer size and sets the overflow policy. By default, the buffer is unbounded.
+        | The rows of a failed save are put back into the buffer, or spilled with `Overflow.SPILL`,
+        | and saved with the next flush.
+        | The numbers of dropped and spilled rows are available as `dropped_rows` and `spilled_rows`.
 
     """
 
+    max_tracked_contexts: int = 10000
+    """
+    The maximum number of unfinished turns whose start times are kept.
+    """
+
+    refresh_lookback: datetime.timedelta = datetime.timedelta(minutes=5)
+    """
+    | How long before the latest loaded start time :py:meth:`~dff_node_stats.stats.Stats.refresh` looks for new rows.
+    | It should exceed the longest turn plus the longest delay between the end of a turn and its flush.
+    """
+
     def __init__(
         self,
         saver: Saver,
         collectors: Optional[List[DSC.Collector]] = None,
+        flush_policy: Optional[FlushPolicy] = None,
+        concurrent: bool = False,
+        trusted: bool = False,
+        sample_rate: Optional[float] = None,
+        buffer_limit: Optional[BufferLimit] = None,
     ) -> None:
         col_default = [DSC.DefaultCollector()]
         collectors = col_default if collectors is None else col_default + collectors
         type_check = lambda x: isinstance(x, DSC.Collector) and not isinstance(x, type)
         if not all(map(type_check, collectors)):
             raise TypeError("Param `collectors` should be a list of collector instances")
+        if sample_rate is not None and not 0 <= sample_rate <= 1:
+            raise ValueError("Param `sample_rate` should be between 0 and 1")
         column_dtypes = dict()
         parse_dates = list()
         for collector in collectors:
             column_dtypes.update(collector.column_dtypes)
             parse_dates.extend(collector.parse_dates)
+        if sample_rate is not None:
+            column_dtypes["sample_rate"] = "float64"
 
         self.saver: Saver = saver
         self.collectors: List[DSC.Collector] = collectors
         self.column_dtypes: Dict[str, str] = column_dtypes
         self.parse_dates: List[str] = parse_dates
-        self.dfs: list = []
-        self.start_time: Optional[datetime.datetime] = None
+        buffer_class = ShardedBuffer if concurrent else ColumnarBuffer
+        self.buffer: Union[ColumnarBuffer, ShardedBuffer] = buffer_class(column_dtypes, parse_dates)
+        self.start_times: BoundedDict = BoundedDict(self.max_tracked_contexts)
+        self.flush_policy: Optional[FlushPolicy] = flush_policy
+        self.flusher: Optional[BackgroundFlusher] = None
+        self.last_flush: float = time.monotonic()
+        self.trusted: bool = trusted
+        self.sample_rate: Optional[float] = sample_rate
+        self._sample_threshold: int = int((1 if sample_rate is None else sample_rate) * 2**32)
+        self._extract: DSC.ExtractorType = DSC.compile_collectors(collectors, trusted=trusted)
+        self.buffer_limit: Optional[BufferLimit] = buffer_limit
+        self.dropped_rows: int = 0
+        self.spilled_rows: int = 0
+        self._spill: Optional[SpoolSaver] = None
+        if buffer_limit is not None and buffer_limit.overflow is Overflow.SPILL:
+            self._spill = SpoolSaver(f"spool://{buffer_limit.spill_path}")
+        self._spill_lock = threading.Lock()
+        self._room = threading.Condition()
+        self._failed_saves: int = 0
+        self._save_lock = threading.Lock()
+        self._save_owner: Optional[int] = None
+        self._refresh_lock = threading.Lock()
+        self._watermark: Optional[pd.Timestamp] = None
+        self._window: Optional[pd.DataFrame] = None
+        self._window_start: Optional[pd.Timestamp] = None
 
     def __deepcopy__(self, *args, **kwargs):
         return copy(self)
 
     @cached_property
     def dataframe(self) -> pd.DataFrame:
-        return self.saver.load(column_types=self.column_dtypes, parse_dates=self.parse_dates)
+        """
+        | The saved data. It is loaded once and updated with the new rows
+        | on :py:meth:`~dff_node_stats.stats.Stats.refresh`.
+        """
+        df = self.saver.load(column_types=self.column_dtypes, parse_dates=self.parse_dates)
+        self._watermark = None
+        self._window = None
+        self._advance_watermark(df)
+        return df
+
+    def refresh(self, lookback: Optional[datetime.timedelta] = None) -> pd.DataFrame:
+        """
+        | Fetch the newly saved rows and append them to :py:attr:`~dff_node_stats.stats.Stats.dataframe`.
+        | A process that polls the saver only reads the rows that started within `lookback`
+        | before the latest loaded `start_time` or later. The rows of this window that are loaded already are skipped.
+        | The window is needed because the rows reach the storage in the order of collection, not of start time:
+        | a long turn is saved after the shorter turns that started later.
+        | Rows that are saved more than `lookback` after their start time are not picked up.
+        | The data is loaded in full on the first call, or if the saver cannot filter by time.
+        | The loaded rows of the window are kept aside, so the following calls only compare the new rows
+        | with the window rather than with the whole dataframe.
+
+        Parameters
+        ----------
+
+        lookback: Optional[datetime.timedelta]
+            Defaults to :py:attr:`~dff_node_stats.stats.Stats.refresh_lookback`.
+        """
+        lookback = self.refresh_lookback if lookback is None else lookback
+        with self._refresh_lock:
+            if "dataframe" not in self.__dict__ or self._watermark is None or not self._loads_time_range:
+                self.__dict__.pop("dataframe", None)
+                return self.dataframe
+            df = self.dataframe
+            since = self._watermark - lookback
+            new_df = self.saver.load(
+                column_types=self.column_dtypes,
+                parse_dates=self.parse_dates,
+                time_range=(since, pd.Timestamp.max),
+            )
+            seen = self._recent_rows(df, since)
+            columns = [column for column in new_df.columns if column in seen.columns]
+            new_df = new_df[~_row_keys(new_df, columns).isin(_row_keys(seen, columns))]
+            if len(new_df):
+                self.__dict__["dataframe"] = pd.concat([df, new_df], ignore_index=True)
+                self._advance_watermark(new_df)
+                seen = pd.concat([seen, new_df], ignore_index=True)
+            self._window, self._window_start = seen, since
+            return self.dataframe
+
+    def _recent_rows(self, df: pd.DataFrame, since: pd.Timestamp) -> pd.DataFrame:
+        """
+        | The rows of `df` that started at `since` or later.
+        | They are taken from the window of the previous refresh, unless it starts later than `since`.
+        """
+        if self._window is None or since < self._window_start:
+            window = df
+        else:
+            window = self._window
+        return window[pd.to_datetime(window[TIME_COLUMN]) >= since]
+
+    @cached_property
+    def _loads_time_range(self) -> bool:
+        return "time_range" in inspect.signature(self.saver.load).parameters
+
+    def _advance_watermark(self, df: pd.DataFrame) -> None:
+        if TIME_COLUMN not in df.columns or df[TIME_COLUMN].isna().all():
+            return
+        latest = pd.to_datetime(df[TIME_COLUMN]).max()
+        if self._watermark is None or latest > self._watermark:
+            self._watermark = latest
+
+    @property
+    def dfs(self) -> List[pd.DataFrame]:
+        """
+        Rows that have been collected but not saved yet, as a list of dataframes.
+        """
+        return [self.buffer.to_dataframe()] if len(self.buffer) else []
+
+    def add_df(self, stats: Dict[str, List[Any]]) -> None:
+        self.buffer.extend(stats)
+
+    def should_flush(self, policy: Optional[FlushPolicy] = None) -> bool:
+        """
+        Check the buffer against the given flush policy or the policy of the instance.
+        """
+        policy = policy or self.flush_policy
+        if policy is None:
+            return len(self.buffer) > 0
+        return policy.should_flush(len(self.buffer), self.buffer.nbytes, time.monotonic() - self.last_flush)
+
+    def maybe_save(self, *args, **kwargs) -> int:
+        """
+        Save the data if the flush policy requires it.
+        """
+        return self.save() if self.should_flush() else 0
 
-    def add_df(self, stats: Dict[str, Any]) -> None:
-        self.dfs += [pd.DataFrame(stats)]
+    def save(self, *args, **kwargs) -> int:
+        self.last_flush = time.monotonic()
+        if not len(self.buffer) and self._spill is None:
+            return 0
+        if self._save_owner == threading.get_ident():
+            raise RuntimeError("Stats.asave is running in this event loop, await it instead of calling Stats.save")
+        with self._save_lock:
+            df, spilled_paths, dfs = self._drain()
+            if not dfs:
+                return 0
+            try:
+                self.saver.save(dfs, column_types=self.column_dtypes, parse_dates=self.parse_dates)
+            except Exception:
+                self._keep_unsaved(df)
+                raise
+            for path in spilled_paths:
+                path.unlink()
+        self._failed_saves = 0
+        return sum(map(len, dfs))
 
-    def save(self, *args, **kwargs):
-        self.saver.save(self.dfs, column_types=self.column_dtypes, parse_dates=self.parse_dates)
-        self.dfs.clear()
+    async def asave(self, *args, **kwargs) -> int:
+        """
+        | Save the buffered rows from a coroutine, e.g. an async actor handler, without blocking the event loop.
+        | Unless the saver implements `asave` natively, the whole :py:meth:`~dff_node_stats.stats.Stats.save` call
+        | runs in the executor of :py:mod:`~dff_node_stats.savers.aio`. The save lock is then held by the executor
+        | thread until the saver returns, even if the awaiting coroutine is cancelled.
+        """
+        if not aio.is_native(self.saver, "asave"):
+            return await aio.run_blocking(self.save)
+        self.last_flush = time.monotonic()
+        if not len(self.buffer) and self._spill is None:
+            return 0
+        while not self._save_lock.acquire(blocking=False):  # a save is running in another thread
+            await asyncio.sleep(0.01)
+        self._save_owner = threading.get_ident()
+        try:
+            if self._spill is None:
+                df, spilled_paths, dfs = self._drain()
+            else:
+                df, spilled_paths, dfs = await aio.run_blocking(self._drain)
+            if not dfs:
+                return 0
+            try:
+                await self.saver.asave(dfs, column_types=self.column_dtypes, parse_dates=self.parse_dates)
+            except (Exception, asyncio.CancelledError):
+                self._keep_unsaved(df)
+                raise
+            for path in spilled_paths:
+                path.unlink()
+        finally:
+            self._save_owner = None
+            self._save_lock.release()
+        self._failed_saves = 0
+        return sum(map(len, dfs))
+
+    def _drain(self) -> Tuple[pd.DataFrame, List[pathlib.Path], List[pd.DataFrame]]:
+        """
+        Take the buffered rows and the spilled segments. Call it under the save lock.
+        """
+        df = self.buffer.drain()
+        with self._room:
+            self._room.notify_all()
+        spilled_paths, spilled_dfs = self._take_spilled()
+        return df, spilled_paths, spilled_dfs + ([df] if len(df) else [])
+
+    def _keep_unsaved(self, df: pd.DataFrame) -> None:
+        """
+        | Keep the rows of a failed save for the next one: spill them or put them back at the head of the buffer.
+        | With the `DROP_OLDEST` and `DROP_NEWEST` policies, the returned rows that do not fit the limit are dropped:
+        | they are both the oldest rows and the rows that come into the buffer.
+        | The turns that wait for room in the buffer with `Overflow.BLOCK` are woken up to drop their rows.
+        """
+        if self._spill is not None:
+            self._spill_rows(df)
+        else:
+            self.buffer.prepend(df)
+            limit = self.buffer_limit
+            while (
+                limit is not None
+                and limit.overflow is not Overflow.BLOCK
+                and len(self.buffer)
+                and limit.is_exceeded(len(self.buffer), self.buffer.nbytes)
+            ):
+                excess = len(self.buffer) - limit.max_rows if limit.max_rows is not None else 0
+                self.dropped_rows += self.buffer.discard_oldest(
+                    excess if excess > 0 else max(1, len(self.buffer) // 10)
+                )
+        with self._room:
+            self._failed_saves += 1
+            self._room.notify_all()
+
+    def _spill_rows(self, df: pd.DataFrame) -> None:
+        if not len(df):
+            return
+        with self._spill_lock:
+            self._spill.save([df], column_types=self.column_dtypes, parse_dates=self.parse_dates)
+        self.spilled_rows += len(df)
+
+    def _take_spilled(self) -> Tuple[List[pathlib.Path], List[pd.DataFrame]]:
+        """
+        Move the spilled segments out of the way of the writers and read them.
+        Segments left by a failed save are read again.
+        """
+        if self._spill is None:
+            return [], []
+        with self._spill_lock:
+            for segment in self._spill.path.glob("*.spool"):
+                os.replace(segment, segment.with_name(f"{segment.stem}.{uuid.uuid4().hex}.flushing"))
+        paths = sorted(self._spill.path.glob("*.flushing"))
+        dfs = [batch for path in paths for _, (_, _, batch) in read_batches(path)]
+        return paths, dfs
+
+    def close(self) -> None:
+        """
+        | Stop the background flusher, if any, and save the remaining rows.
+        | Inside the event loop of an asyncio flusher, await :py:meth:`~dff_node_stats.stats.Stats.aclose` instead.
+        """
+        if self.flusher is not None:
+            self.flusher.stop()
+        else:
+            self.save()
+
+    async def aclose(self) -> None:
+        """
+        Stop the background flusher, if any, and save the remaining rows without blocking the event loop.
+        """
+        if self.flusher is not None:
+            await self.flusher.astop()
+        else:
+            await self.asave()
+
+    def is_sampled(self, context_id: Any) -> bool:
+        """
+        Check whether the dialog with the given context id should be collected.
+        """
+        if self.sample_rate is None:
+            return True
+        return zlib.crc32(str(context_id).encode()) < self._sample_threshold
 
     @validate_arguments
-    def _update_handlers(self, actor: Actor, stage: ActorStage, handler) -> Actor:
+    def _update_handlers(self, actor: Actor, stage: ActorStage, handler, per_context: bool = False) -> Actor:
+        """
+        Append a handler to the actor stage.
+        Handlers registered with `per_context=True` are skipped for dialogs excluded by sampling.
+        """
+        if per_context and self.sample_rate is not None:
+            handler = self._sampled(handler)
         actor.handlers[stage] = actor.handlers.get(stage, []) + [handler]
         return actor
 
-    def update_actor_handlers(self, actor: Actor, auto_save: bool = True, *args, **kwargs):
-        actor = self._update_handlers(actor, ActorStage.CONTEXT_INIT, self.get_start_time)
-        actor = self._update_handlers(actor, ActorStage.FINISH_TURN, self.collect_stats)
-        if auto_save:
+    def _sampled(self, handler: Callable) -> Callable:
+        is_sampled = self.is_sampled
+
+        def sampled_handler(ctx: Context, actor: Actor, *args, **kwargs) -> None:
+            if is_sampled(ctx.id):
+                handler(ctx, actor, *args, **kwargs)
+
+        return sampled_handler
+
+    def update_actor_handlers(self, actor: Actor, auto_save: bool = True, background: bool = False, *args, **kwargs):
+        """
+        Register the collection handlers in the actor.
+
+        Parameters
+        ----------
+
+        actor: :py:class:`~df_engine.core.actor.Actor`
+        auto_save: bool
+            Whether the data should be saved automatically. Defaults to True.
+        background: bool
+            | Save the data in a :py:class:`~dff_node_stats.flush.BackgroundFlusher`
+            | instead of the actor turn. Extra arguments are passed to the flusher.
+        """
+        if self.trusted and not isinstance(actor, Actor):
+            raise TypeError("Param `actor` should be an instance of the Actor class")
+        for collector in self.collectors:
+            if hasattr(collector, "update_actor_handlers"):
+                actor = collector.update_actor_handlers(self, actor)
+        if self.trusted:
+            actor = self._update_handlers(actor, ActorStage.CONTEXT_INIT, self._get_start_time, per_context=True)
+            actor = self._update_handlers(actor, ActorStage.FINISH_TURN, self._finish_turn, per_context=True)
+        else:
+            actor = self._update_handlers(actor, ActorStage.CONTEXT_INIT, self.get_start_time, per_context=True)
+            actor = self._update_handlers(actor, ActorStage.FINISH_TURN, self.finish_turn, per_context=True)
+        if auto_save and background:
+            if self.flusher is None:
+                self.flusher = BackgroundFlusher(self, *args, **kwargs)
+            self.flusher.start()
+            actor = self._update_handlers(actor, ActorStage.FINISH_TURN, self.flusher.notify)
+        elif auto_save and self.flush_policy is not None:
+            actor = self._update_handlers(actor, ActorStage.FINISH_TURN, self.maybe_save)
+        elif auto_save:
             actor = self._update_handlers(actor, ActorStage.FINISH_TURN, self.save)
 
     @validate_arguments
     def get_start_time(self, ctx: Context, actor: Actor, *args, **kwargs) -> None:
-        self.start_time = datetime.datetime.now()
-        self.collect_stats(ctx, actor, *args, **kwargs)
+        self._get_start_time(ctx, actor, *args, **kwargs)
+
+    @validate_arguments
+    def finish_turn(self, ctx: Context, actor: Actor, *args, **kwargs) -> None:
+        self._finish_turn(ctx, actor, *args, **kwargs)
 
     @validate_arguments
     def collect_stats(self, ctx: Context, actor: Actor, *args, **kwargs) -> None:
-        stats = dict()
-        for collector in self.collectors:
-            stats.update(collector.collect_stats(ctx, actor, start_time=self.start_time))
-        self.add_df(stats=stats)
+        self._collect_stats(ctx, actor, *args, **kwargs)
+
+    def _get_start_time(self, ctx: Context, actor: Actor, *args, **kwargs) -> None:
+        self.start_times[ctx.id] = (datetime.datetime.now(), time.perf_counter_ns())
+        self._collect_stats(ctx, actor, *args, **kwargs)
+
+    def _finish_turn(self, ctx: Context, actor: Actor, *args, **kwargs) -> None:
+        self._collect_stats(ctx, actor, *args, **kwargs)
+        self.start_times.pop(ctx.id, None)
+
+    def _collect_stats(self, ctx: Context, actor: Actor, *args, **kwargs) -> None:
+        start_time, start_ns = self.start_times.get(ctx.id, (None, None))
+        row = self._extract(ctx, actor, start_time=start_time, start_ns=start_ns)
+        if self.sample_rate is not None:
+            row["sample_rate"] = self.sample_rate
+        self._add_row(row)
+
+    def _add_row(self, row: Dict[str, Any]) -> None:
+        limit = self.buffer_limit
+        if limit is not None and limit.is_full(len(self.buffer), self.buffer.nbytes):
+            if not self._make_room(limit):
+                self.dropped_rows += 1
+                return
+        self.buffer.append(row)
+
+    def _make_room(self, limit: BufferLimit) -> bool:
+        """
+        | Apply the overflow policy to the full buffer. Returns False if the incoming row should be dropped.
+        | With `Overflow.BLOCK`, the turn waits for the background flush until it succeeds, fails or times out.
+        | Without a flusher, the buffer is saved in place unless the previous save failed less than
+        | `block_timeout` seconds ago.
+        """
+        if limit.overflow is Overflow.DROP_NEWEST:
+            return False
+        if limit.overflow is Overflow.DROP_OLDEST:
+            self.dropped_rows += self.buffer.discard_oldest(max(1, len(self.buffer) // 10))
+            return True
+        if limit.overflow is Overflow.SPILL:
+            self._spill_rows(self.buffer.drain())
+            return True
+        if self.flusher is not None and self.flusher.can_be_awaited:
+            with self._room:
+                failed_saves = self._failed_saves
+                self.flusher.wake(force=True)
+                self._room.wait_for(
+                    lambda: not limit.is_full(len(self.buffer), self.buffer.nbytes)
+                    or self._failed_saves != failed_saves,
+                    timeout=limit.block_timeout,
+                )
+                return not limit.is_full(len(self.buffer), self.buffer.nbytes)
+        if self._failed_saves and (
+            limit.block_timeout is not None and time.monotonic() - self.last_flush < limit.block_timeout
+        ):
+            return False
+        try:
+            self.save()
+        except Exception:
+            return False
+        return True
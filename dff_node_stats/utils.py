@@ -5,10 +5,15 @@ Utilities for processing statistics inside the module.
 
 #. :py:const:`TransformType <dff_node_stats.utils.TransformType>` defines the signature that the user-created transform functions should comply with.
 #. py:const:`DffStatsException <dff_node_stats.utils.DffStatsException>` should be raised in module-specific error conditions.
+#. :py:class:`BoundedDict <dff_node_stats.utils.BoundedDict>` is a mapping that evicts its oldest entries.
+#. :py:func:`filter_dataframe <dff_node_stats.utils.filter_dataframe>` applies the `time_range` and `filters`
+   arguments of the saver `load` methods to a loaded dataframe.
 
 """
+from collections import OrderedDict
 from functools import partial, wraps
-from typing import List, Callable
+from typing import Any, Dict, Iterable, List, Callable, Optional, Tuple
+import datetime
 
 import pandas as pd
 
@@ -21,12 +26,95 @@ TransformType = Callable[[pd.DataFrame], pd.DataFrame]
 """
 
 
+TimeRange = Tuple[datetime.datetime, datetime.datetime]
+"""
+Inclusive bounds of the `start_time` column.
+"""
+
+Filters = Dict[str, Any]
+"""
+| Equality conditions on columns, e.g. `{"flow_label": "root"}`.
+| A list, tuple or set value matches any of its items.
+"""
+
+TIME_COLUMN = "start_time"
+
+
+def filter_values(value: Any) -> list:
+    """
+    The list of values matched by a filter.
+    """
+    return list(value) if isinstance(value, (list, tuple, set, frozenset)) else [value]
+
+
+def filter_dataframe(
+    df: pd.DataFrame, time_range: Optional[TimeRange] = None, filters: Optional[Filters] = None
+) -> pd.DataFrame:
+    """
+    Keep the rows that match the `time_range` and the `filters`.
+    A filter on a missing column matches no rows.
+    """
+    mask = pd.Series(True, index=df.index)
+    if time_range is not None:
+        times = pd.to_datetime(df[TIME_COLUMN]) if TIME_COLUMN in df.columns else pd.Series(pd.NaT, index=df.index)
+        mask &= times.between(pd.Timestamp(time_range[0]), pd.Timestamp(time_range[1]))
+    for column, value in (filters or {}).items():
+        mask &= df[column].isin(filter_values(value)) if column in df.columns else False
+    return df if mask.all() else df[mask].reset_index(drop=True)
+
+
+def cast_columns(
+    df: pd.DataFrame, column_types: Optional[Dict[str, str]] = None, parse_dates: Iterable[str] = ()
+) -> pd.DataFrame:
+    """
+    | Convert the loaded columns to the collector types where possible.
+    | Text columns are left as they are, so that missing values are not turned into strings.
+    """
+    for column in parse_dates:
+        if column in df.columns and not pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = pd.to_datetime(df[column])
+    for column, dtype in (column_types or {}).items():
+        if column not in df.columns or column in parse_dates or dtype in ("str", "object") or df[column].dtype == dtype:
+            continue
+        try:
+            df[column] = df[column].astype(dtype)
+        except (ValueError, TypeError):  # e.g. missing values in an integer column
+            pass
+    return df
+
+
 class DffStatsException(Exception):
     """Exception to raise for module-specific errors."""
 
     pass
 
 
+class BoundedDict(OrderedDict):
+    """
+    | A dict that keeps at most `maxsize` entries.
+    | When a new key is added to a full dict, the least recently added key is evicted.
+
+    Parameters
+    ----------
+
+    maxsize: int
+        The maximum number of entries.
+    """
+
+    def __init__(self, maxsize: int, *args, **kwargs) -> None:
+        self.maxsize = maxsize
+        super().__init__(*args, **kwargs)
+
+    def __setitem__(self, key, value) -> None:
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            try:
+                self.popitem(last=False)
+            except KeyError:  # emptied by another thread
+                break
+
+
 def transform_once(func: TransformType):
     """
     Caches the transformations results by columns
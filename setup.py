@@ -34,7 +34,8 @@ setuptools.setup(
             "plotly>=5.5.0",
         ],
         "dev": [
-            "infi.clickhouse-orm==2.1.1",
+            "requests>=2.26.0",
+            "pyarrow>=6.0.0",
             "psycopg2>=2.9.2",
             "SQLAlchemy==1.4.27",
             "fastapi>=0.68.0",
@@ -46,7 +47,8 @@ setuptools.setup(
             "plotly>=5.5.0",
         ],
         "all": [
-            "infi.clickhouse-orm==2.1.1",
+            "requests>=2.26.0",
+            "pyarrow>=6.0.0",
             "psycopg2>=2.9.2",
             "SQLAlchemy==1.4.27",
             "fastapi>=0.68.0",
@@ -58,7 +60,9 @@ setuptools.setup(
             "plotly>=5.5.0",
         ],
         "pg": ["psycopg2>=2.9.2", "SQLAlchemy==1.4.27"],
-        "clickhouse": ["infi.clickhouse-orm==2.1.1"],
+        "clickhouse": ["requests>=2.26.0"],
+        "parquet": ["pyarrow>=6.0.0"],
+        "arrow": ["pyarrow>=6.0.0"],
     },
     install_requires=[
         "pandas>=1.3.1",
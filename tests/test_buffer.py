@@ -0,0 +1,61 @@
+import threading
+
+import pandas as pd
+
+from dff_node_stats.buffer import ColumnarBuffer, ShardedBuffer
+
+
+def test_buffer_types():
+    buffer = ColumnarBuffer(
+        {"history_id": "int64", "start_time": "datetime64[ns]", "flow_label": "str"}, ["start_time"]
+    )
+    buffer.extend({"history_id": [1], "start_time": [pd.Timestamp.now()], "flow_label": ["root"]})
+    buffer.append({"history_id": 2, "start_time": pd.Timestamp.now(), "flow_label": "root"})
+    assert len(buffer) == 2
+    df = buffer.to_dataframe()
+    assert df["history_id"].dtype == "int64"
+    assert df["start_time"].dtype == "datetime64[ns]"
+    assert len(buffer) == 2
+
+
+def test_buffer_drain():
+    buffer = ColumnarBuffer({"foo": "str"})
+    buffer.append({"foo": "bar"})
+    buffer.append({"baz": "qux"})
+    df = buffer.drain()
+    assert len(buffer) == 0
+    assert list(df.columns) == ["foo", "baz"]
+    assert df["foo"].tolist() == ["bar", None]
+    assert df["baz"].tolist() == [None, "qux"]
+    assert buffer.drain().empty
+
+
+def test_buffer_prepend():
+    buffer = ColumnarBuffer({"history_id": "int64", "start_time": "datetime64[ns]"}, ["start_time"])
+    buffer.append({"history_id": 1, "start_time": pd.Timestamp("2022-05-30"), "flow_label": "root"})
+    df = buffer.drain()
+    buffer.append({"history_id": 2, "start_time": pd.Timestamp("2022-05-31")})
+    buffer.prepend(df)
+    assert len(buffer) == 2
+    assert buffer.nbytes > 0
+    df = buffer.drain()
+    assert df["history_id"].tolist() == [1, 2]
+    assert df["flow_label"].tolist() == ["root", None]
+    assert df["start_time"].dtype == "datetime64[ns]"
+
+
+def test_sharded_buffer():
+    buffer = ShardedBuffer({"foo": "str", "history_id": "int64"})
+    buffer.append({"foo": "bar", "history_id": 1})
+    worker = threading.Thread(target=buffer.append, args=({"baz": "qux", "history_id": 2},))
+    worker.start()
+    worker.join()
+    assert len(buffer) == 2
+    assert len(buffer.to_dataframe()) == 2
+    df = buffer.drain()
+    assert len(buffer) == 0
+    assert df["history_id"].tolist() == [1, 2]
+    assert df["history_id"].dtype == "int64"
+    assert df["foo"].tolist() == ["bar", None]
+    assert df["baz"].tolist() == [None, "qux"]
+    assert len(buffer._shards) == 1
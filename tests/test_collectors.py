@@ -1,7 +1,15 @@
+import datetime
+import math
+import time
+
 import pytest
+from df_engine.core import Actor, Context
+from df_engine.core.types import ActorStage
+from df_engine.core.keywords import RESPONSE
 
 from dff_node_stats import collectors as DSC
 from dff_node_stats import Stats
+from dff_node_stats.utils import BoundedDict
 
 
 def test_inheritance():
@@ -65,3 +73,126 @@ def test_context_collection(data_generator, testing_saver):
     first = stats_object.dfs[0]
     assert "foo" in first.columns
     assert "bar" in first["foo"].values
+
+
+def test_interleaved_durations(testing_saver):
+    actor = Actor({"flow": {"node": {}}}, start_label=("flow", "node"))
+    stats = Stats(saver=testing_saver, collectors=None)
+    first, second = Context(), Context()
+    stats.get_start_time(first, actor)
+    time.sleep(0.05)
+    stats.get_start_time(second, actor)
+    stats.finish_turn(second, actor)
+    stats.finish_turn(first, actor)
+    df = stats.dfs[0]
+    durations = df.groupby("context_id")["duration_time"].max()
+    assert durations[str(first.id)] >= 0.05
+    assert durations[str(second.id)] < 0.05
+    assert len(stats.start_times) == 0
+
+
+def test_duration_fallback():
+    ctx = Context()
+    actor = Actor({"flow": {"node": {}}}, start_label=("flow", "node"))
+    start_time = datetime.datetime.now() - datetime.timedelta(seconds=1)
+    row = DSC.compile_collectors([DSC.DefaultCollector()])(ctx, actor, start_time=start_time)
+    assert row["start_time"] == start_time
+    assert row["duration_time"] >= 1
+    row = DSC.compile_collectors([DSC.DefaultCollector()])(ctx, actor)
+    assert math.isnan(row["duration_time"])
+
+
+def test_bounded_start_times():
+    start_times = BoundedDict(2)
+    for key in range(3):
+        start_times[key] = key
+    assert list(start_times) == [1, 2]
+
+
+def test_trusted_collection(data_generator, testing_saver):
+    collectors = [DSC.NodeLabelCollector(), DSC.RequestCollector()]
+    stats = Stats(saver=testing_saver, collectors=collectors, trusted=True)
+    actor = Actor({"flow": {"node": {}}}, start_label=("flow", "node"))
+    stats.update_actor_handlers(actor, auto_save=False)
+    assert stats.get_start_time not in actor.handlers[ActorStage.CONTEXT_INIT]
+    with pytest.raises(TypeError):
+        stats.update_actor_handlers({"flow": {}}, auto_save=False)
+    stats_object: Stats = data_generator(stats, 3)
+    first = stats_object.dfs[0]
+    assert {"context_id", "history_id", "start_time", "duration_time"} < set(first.columns)
+    assert {"flow_label", "node_label", "user_request"} < set(first.columns)
+
+
+def test_compile_collectors():
+    ctx = Context()
+    ctx.add_request("hi")
+    actor = Actor({"flow": {"node": {}}}, start_label=("flow", "node"))
+    collectors = [DSC.DefaultCollector(), DSC.RequestCollector()]
+    validated = DSC.compile_collectors(collectors)(ctx, actor)
+    trusted = DSC.compile_collectors(collectors, trusted=True)(ctx, actor)
+    assert validated.keys() == trusted.keys()
+    assert trusted["user_request"] == "hi"
+
+
+def test_field_collection():
+    class LegacyCollector:
+        column_dtypes = {"legacy": "str"}
+        parse_dates = []
+
+        def collect_stats(self, ctx, actor, *args, **kwargs):
+            return {"legacy": [ctx.last_request]}
+
+    ctx = Context()
+    ctx.add_request("hi")
+    actor = Actor({"flow": {"node": {}}}, start_label=("flow", "node"))
+    collectors = [DSC.DefaultCollector(), LegacyCollector(), DSC.RequestCollector(), DSC.NodeLabelCollector()]
+    assert isinstance(collectors[0], DSC.FieldCollector)
+    assert not isinstance(collectors[1], DSC.FieldCollector)
+    row = DSC.compile_collectors(collectors)(ctx, actor)
+    assert list(row) == [
+        "context_id",
+        "history_id",
+        "start_time",
+        "duration_time",
+        "legacy",
+        "user_request",
+        "flow_label",
+        "node_label",
+    ]
+    assert row["legacy"] == row["user_request"] == "hi"
+    assert row["history_id"] == -1
+    assert (row["flow_label"], row["node_label"]) == ("flow", "node")
+    assert DSC.RequestCollector().collect_stats(ctx, actor) == {"user_request": ["hi"]}
+
+
+def test_overridden_collect_stats():
+    class OverriddenCollector(DSC.NodeLabelCollector):
+        def collect_stats(self, ctx, actor, *args, **kwargs):
+            return {"flow_label": ["OVERRIDDEN"], "node_label": ["OVERRIDDEN"]}
+
+    ctx = Context()
+    actor = Actor({"flow": {"node": {}}}, start_label=("flow", "node"))
+    for trusted in (False, True):
+        row = DSC.compile_collectors([DSC.DefaultCollector(), OverriddenCollector()], trusted=trusted)(ctx, actor)
+        assert row["flow_label"] == row["node_label"] == "OVERRIDDEN"
+        assert "context_id" in row
+
+
+def test_stage_timing_collection(testing_saver):
+    def slow_response(ctx, actor, *args, **kwargs):
+        time.sleep(0.02)
+        return "hello"
+
+    actor = Actor({"flow": {"node": {RESPONSE: slow_response}}}, start_label=("flow", "node"))
+    collector = DSC.StageTimingCollector()
+    stats = Stats(saver=testing_saver, collectors=[collector])
+    stats.update_actor_handlers(actor, auto_save=False)
+    assert all(len(actor.handlers[stage]) >= 1 for stage in ActorStage)
+    ctx = Context()
+    ctx.add_request("hi")
+    actor(ctx)
+    finished = stats.dfs[0].iloc[-1]
+    assert finished["create_response_duration"] >= 0.02
+    assert finished["get_next_node_duration"] < 0.02
+    assert finished[list(collector.column_dtypes)].notna().all()
+    assert len(collector.timestamps) == 0
@@ -0,0 +1,216 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from df_engine.core import Actor, Context
+from df_engine.core.types import ActorStage
+
+from dff_node_stats import Stats
+from dff_node_stats.flush import BackgroundFlusher, FlushPolicy
+
+from examples.collect_stats import plot
+
+
+def test_update_actor_handlers(memory_saver):
+    saver = memory_saver
+    stats = Stats(saver=saver, flush_policy=FlushPolicy(max_rows=4, max_interval=0.01))
+    actor = Actor(plot, start_label=("root", "start"), fallback_label=("root", "fallback"))
+    stats.update_actor_handlers(actor, auto_save=True, background=True)
+    assert stats.flusher.running
+    assert stats.flusher.notify in actor.handlers[ActorStage.FINISH_TURN]
+    assert stats.save not in actor.handlers[ActorStage.FINISH_TURN]
+    ctx = Context()
+    for request in ["hi", "fine", "dog"]:
+        ctx.add_request(request)
+        ctx = actor(ctx)
+    stats.close()
+    assert saver.rows == 6
+    assert len(stats.buffer) == 0
+
+
+def test_background_save(data_generator, memory_saver):
+    saver = memory_saver
+    stats = Stats(saver=saver)
+    flusher = BackgroundFlusher(stats, FlushPolicy(max_rows=10, max_interval=0.01)).start()
+    stats.flusher = flusher
+    assert flusher.running
+    data_generator(stats, 5)
+    time.sleep(0.1)
+    assert flusher.flush_count > 0
+    stats.close()
+    assert not flusher.running
+    assert len(stats.buffer) == 0
+    counters = flusher.counters
+    assert counters["queue_depth"] == 0
+    assert counters["flushed_rows"] == saver.rows > 0
+    assert counters["max_flush_latency"] >= counters["mean_flush_latency"] > 0
+
+
+def test_async_flusher(memory_saver):
+    saver = memory_saver
+    stats = Stats(saver=saver)
+
+    async def run():
+        flusher = BackgroundFlusher(stats, FlushPolicy(max_rows=2, max_interval=10)).start()
+        assert flusher._task is not None
+        stats.buffer.extend({"context_id": ["a", "b"]})
+        flusher.notify()
+        await asyncio.sleep(0.05)
+        assert flusher.flush_count == 1
+        stats.buffer.extend({"context_id": ["c"]})
+        await flusher.astop()
+        return flusher
+
+    flusher = asyncio.run(run())
+    assert flusher.flushed_rows == saver.rows == 3
+
+
+@pytest.mark.parametrize("native", [False, True])
+def test_async_save(memory_saver, native):
+    awaited = []
+    if native:
+
+        async def asave(dfs, column_types=None, parse_dates=False):
+            await asyncio.sleep(0)
+            awaited.append(len(dfs))
+            memory_saver.save(dfs, column_types, parse_dates)
+
+        memory_saver.asave = asave
+
+    async def run():
+        stats = Stats(saver=memory_saver)
+        stats.buffer.extend({"context_id": ["a", "b"]})
+        assert await stats.asave() == 2
+        assert await stats.asave() == 0
+        stats.buffer.extend({"context_id": ["c"]})
+        await stats.aclose()
+        assert len(stats.buffer) == 0
+
+    asyncio.run(run())
+    assert memory_saver.rows == 3
+    assert len(awaited) == (2 if native else 0)
+
+
+def slow_save(saver, delay):
+    """
+    Make the saves of a memory saver slow and record how many of them run at once.
+    """
+    save, running = saver.save, []
+    saver.max_running = 0
+
+    def wrapper(*args, **kwargs):
+        running.append(None)
+        saver.max_running = max(saver.max_running, len(running))
+        time.sleep(delay)
+        try:
+            save(*args, **kwargs)
+        finally:
+            running.pop()
+
+    saver.save = wrapper
+
+
+def test_close_in_flusher_loop(memory_saver):
+    slow_save(memory_saver, 0.2)
+    stats = Stats(saver=memory_saver)
+
+    async def run():
+        stats.flusher = BackgroundFlusher(stats, FlushPolicy(max_rows=1, max_interval=10)).start()
+        stats.buffer.extend({"context_id": ["a"]})
+        stats.flusher.notify()
+        await asyncio.sleep(0.05)  # the flush is in progress
+        stats.buffer.extend({"context_id": ["b"]})
+        with pytest.raises(RuntimeError):
+            stats.close()
+        await stats.aclose()
+
+    asyncio.run(asyncio.wait_for(run(), timeout=5))
+    assert memory_saver.rows == 2
+    assert memory_saver.max_running == 1
+
+
+def test_close_waits_for_loop_flush(memory_saver):
+    slow_save(memory_saver, 0.2)
+    stats = Stats(saver=memory_saver)
+    loop = asyncio.new_event_loop()
+    worker = threading.Thread(target=loop.run_forever, daemon=True)
+    worker.start()
+
+    async def start():
+        stats.flusher = BackgroundFlusher(stats, FlushPolicy(max_rows=1, max_interval=10)).start()
+
+    asyncio.run_coroutine_threadsafe(start(), loop).result()
+    stats.buffer.extend({"context_id": ["a"]})
+    stats.flusher.notify()
+    time.sleep(0.05)  # the flush is in progress
+    stats.buffer.extend({"context_id": ["b"]})
+    stats.close()
+    assert memory_saver.rows == 2
+    assert memory_saver.max_running == 1
+    loop.call_soon_threadsafe(loop.stop)
+    worker.join()
+    loop.close()
+
+
+def test_cancelled_asave(memory_saver):
+    slow_save(memory_saver, 0.2)
+    stats = Stats(saver=memory_saver)
+
+    async def run():
+        stats.buffer.extend({"context_id": ["a"]})
+        task = asyncio.ensure_future(stats.asave())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        stats.buffer.extend({"context_id": ["b"]})
+        # the cancelled save still holds the lock until the saver returns
+        assert await stats.asave() == 1
+
+    asyncio.run(run())
+    assert memory_saver.rows == 2
+    assert memory_saver.max_running == 1
+
+
+def test_save_during_native_asave(memory_saver):
+    stats = Stats(saver=memory_saver)
+
+    async def asave(dfs, column_types=None, parse_dates=False):
+        stats.buffer.extend({"context_id": ["b"]})
+        with pytest.raises(RuntimeError):
+            stats.save()  # would wait for the lock held by this coroutine
+        memory_saver.save(dfs, column_types, parse_dates)
+
+    memory_saver.asave = asave
+    stats.buffer.extend({"context_id": ["a"]})
+    assert asyncio.run(stats.asave()) == 1
+    assert stats.save() == 1
+    assert memory_saver.rows == 2
+
+
+def test_flush_policy():
+    with pytest.raises(ValueError):
+        FlushPolicy()
+    assert not FlushPolicy(max_rows=1).should_flush(0, 0, 100)
+    assert FlushPolicy(max_rows=2).should_flush(2, 0, 0)
+    assert not FlushPolicy(max_rows=2).should_flush(1, 10**9, 100)
+    assert FlushPolicy(max_rows=2, max_bytes=100).should_flush(1, 100, 0)
+    assert FlushPolicy(max_rows=2, max_interval=1.0).should_flush(1, 0, 1.5)
+
+
+def test_policy_handlers(memory_saver):
+    saver = memory_saver
+    stats = Stats(saver=saver, flush_policy=FlushPolicy(max_rows=5))
+    actor = Actor(plot, start_label=("root", "start"), fallback_label=("root", "fallback"))
+    stats.update_actor_handlers(actor, auto_save=True)
+    assert stats.maybe_save in actor.handlers[ActorStage.FINISH_TURN]
+    ctx = Context()
+    for request in ["hi", "fine", "dog"]:
+        ctx.add_request(request)
+        ctx = actor(ctx)
+    assert saver.rows == 6
+    assert len(stats.buffer) == 0
+    ctx.add_request("let's talk about news")
+    ctx = actor(ctx)
+    assert saver.rows == 6
+    assert len(stats.buffer) == 2
+    assert stats.buffer.nbytes > 0
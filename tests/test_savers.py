@@ -1,13 +1,20 @@
+from multiprocessing import Process
+import json
 import sys
 import pathlib
 
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pass
 try:
     import sqlalchemy
-    from infi import clickhouse_orm
 except ImportError:
     pass
+import pandas as pd
 import pytest
 from dff_node_stats import Saver, Stats
+from dff_node_stats.savers.spool import SpoolAggregator
 
 
 def test_uri():
@@ -41,13 +48,6 @@ if "sqlalchemy" in sys.modules:
         yield connection
         connection.close()
 
-    @pytest.fixture(scope="session")
-    def CH_connection(CH_uri_string):
-        engine = sqlalchemy.create_engine(CH_uri_string)
-        connection = engine.connect()
-        yield connection
-        connection.close()
-
 
 @pytest.mark.xfail
 @pytest.mark.skipif("sqlalchemy" not in sys.modules, reason="Postgres extra not installed")
@@ -65,17 +65,546 @@ def test_PG_saving(PG_connection, PG_uri_string, data_generator):
     assert set(df.columns) == initial_cols
 
 
+@pytest.mark.skipif("sqlalchemy" not in sys.modules, reason="Postgres extra not installed")
+def test_PG_copy_rows():
+    from types import SimpleNamespace
+    from dff_node_stats.savers.postgresql import copy_rows
+
+    class Cursor:
+        rowcount = 2
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def copy_expert(self, statement, file):
+            self.statement, self.data = statement, file.read()
+
+    cursor = Cursor()
+    connection = SimpleNamespace(connection=SimpleNamespace(cursor=lambda: cursor))
+    table = SimpleNamespace(name="dff_stats", schema=None)
+    rows = [("a", 1, {"key": "value"}), ("b,c", None, None)]
+    assert copy_rows(table, connection, ["context_id", "history_id", "misc"], iter(rows)) == 2
+    assert cursor.statement.startswith('COPY "dff_stats" ("context_id", "history_id", "misc") FROM STDIN')
+    assert cursor.data.splitlines() == ['a,1,"{""key"": ""value""}"', '"b,c",\\N,\\N']
+
+
+@pytest.mark.skipif("sqlalchemy" not in sys.modules, reason="Postgres extra not installed")
+def test_PG_migrate(monkeypatch):
+    from types import SimpleNamespace
+    from dff_node_stats.savers import postgresql
+
+    class Inspector:
+        def __init__(self, columns):
+            self.columns = columns
+
+        def has_table(self, table):
+            return self.columns is not None
+
+        def get_columns(self, table):
+            return [{"name": column} for column in self.columns]
+
+    statements = []
+    connection = SimpleNamespace(execute=statements.append)
+    saver = postgresql.PostgresSaver.__new__(postgresql.PostgresSaver)
+    saver.table = "dff_stats"
+    column_types = {"context_id": "str", "history_id": "int64", "start_time": "datetime64[ns]"}
+    df = pd.DataFrame(
+        {
+            "context_id": ["a", "b"],
+            "history_id": [1, None],
+            "start_time": pd.to_datetime(["2022-05-30", "2022-05-31"]),
+            "user_tag": pd.Series([1, None], dtype=object),
+            "score": pd.Series([None, 0.5], dtype=object),
+        }
+    )
+    monkeypatch.setattr(postgresql, "inspect", lambda connection: Inspector(None))
+    saver._migrate(connection, df, column_types)
+    assert statements.pop() == (
+        'CREATE TABLE IF NOT EXISTS "dff_stats" ("context_id" TEXT, "history_id" BIGINT, "start_time" TIMESTAMP, '
+        '"user_tag" BIGINT, "score" DOUBLE PRECISION)'
+    )
+    monkeypatch.setattr(postgresql, "inspect", lambda connection: Inspector(["context_id", "history_id"]))
+    saver._migrate(connection, df, column_types)
+    assert statements == [
+        'ALTER TABLE "dff_stats" ADD COLUMN IF NOT EXISTS "start_time" TIMESTAMP',
+        'ALTER TABLE "dff_stats" ADD COLUMN IF NOT EXISTS "user_tag" BIGINT',
+        'ALTER TABLE "dff_stats" ADD COLUMN IF NOT EXISTS "score" DOUBLE PRECISION',
+    ]
+
+
+@pytest.fixture
+def CH_saver(CH_uri_string):
+    requests = pytest.importorskip("requests")
+    saver = Saver(CH_uri_string)
+    try:
+        requests.get(saver.url + "/ping", timeout=1)
+    except requests.RequestException:
+        pytest.skip("Clickhouse server is not available")
+    yield saver
+
+
 @pytest.mark.xfail
-@pytest.mark.skipif(
-    ("infi" not in sys.modules or "sqlalchemy" not in sys.modules), reason="Clickhouse extra not installed"
-)
-def test_CH_saving(CH_connection, CH_uri_string, data_generator):
-    stats = Stats(saver=Saver(CH_uri_string))
+def test_CH_saving(CH_saver, data_generator):
+    stats = Stats(saver=CH_saver)
     stats_object = data_generator(stats, 3)
     initial_cols = set(stats_object.dfs[0].columns)
     stats_object.save()
-    result = CH_connection.execute("SELECT COUNT (*) FROM dff_stats")
-    first = result.first()
-    assert int(first[0]) > 0
+    assert int(CH_saver.query("SELECT COUNT(*) FROM dff_stats")) > 0
     df = stats_object.dataframe
     assert set(df.columns) == initial_cols
+
+
+def spool_worker(path, n_batches):
+    saver = Saver(path)
+    for i in range(n_batches):
+        saver.save(
+            [pd.DataFrame({"context_id": [str(i)] * 5, "history_id": range(5)})],
+            {"context_id": "str", "history_id": "int64"},
+            [],
+        )
+
+
+def test_spool_aggregation(tmp_path):
+    spool_uri = "spool://{}".format(tmp_path / "spool")
+    workers = [Process(target=spool_worker, args=(spool_uri, 3)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert len(list((tmp_path / "spool").glob("*.spool"))) == 3
+    assert len(Saver(spool_uri).load()) == 45
+
+    target = Saver("csv://{}".format(tmp_path / "stats.csv"))
+    aggregator = SpoolAggregator(spool_uri, target)
+    assert aggregator.run_once() == 45
+    assert aggregator.run_once() == 0
+    spool_worker(spool_uri, 1)
+    assert aggregator.run_once() == 5
+    df = target.load(column_types={"context_id": "str", "history_id": "int64"})
+    assert len(df) == 50
+
+
+def test_spool_segment_rotation(tmp_path):
+    saver = Saver("spool://{}".format(tmp_path))
+    saver.max_segment_bytes = 1
+    for _ in range(3):
+        saver.save([pd.DataFrame({"foo": ["bar"]})], {"foo": "str"}, [])
+    assert len(list(tmp_path.glob("*.spool"))) == 3
+    target = Saver("csv://{}".format(tmp_path / "stats.csv"))
+    assert SpoolAggregator(str(tmp_path), target).run_once() == 3
+    assert len(list(tmp_path.glob("*.spool"))) == 1
+
+
+def test_csv_append(tmp_path, monkeypatch):
+    saver = Saver("csv://{}".format(tmp_path / "stats.csv"), fsync=True)
+    assert saver.fsync
+    saver.save([pd.DataFrame({"foo": ["a", "b"], "bar": [1, 2]})], {"foo": "str", "bar": "int64"}, [])
+    monkeypatch.setattr(saver, "load", lambda *args, **kwargs: pytest.fail("the saved data should not be loaded"))
+    saver.save([pd.DataFrame({"bar": [3], "foo": ["c"]})], {"foo": "str", "bar": "int64"}, [])
+    assert saver.columns == ["foo", "bar"]
+    assert (tmp_path / "stats.csv").read_text().count("foo") == 1
+    monkeypatch.undo()
+    df = saver.load(column_types={"foo": "str", "bar": "int64"})
+    assert df["foo"].tolist() == ["a", "b", "c"]
+    assert df["bar"].tolist() == [1, 2, 3]
+
+
+def test_csv_schema_change(tmp_path):
+    saver = Saver("csv://{}".format(tmp_path / "stats.csv"))
+    saver.save([pd.DataFrame({"foo": ["a,\nb"], "bar": [1]})], {"foo": "str", "bar": "int64"}, [])
+    first_segment = (tmp_path / "stats.csv").read_text()
+    saver.save([pd.DataFrame({"foo": ["c"], "baz": [0.5]})], {"foo": "str", "baz": "float64"}, [])
+    saver.save([pd.DataFrame({"foo": ["d"], "bar": [4]})], {"foo": "str", "bar": "int64"}, [])
+    assert (tmp_path / "stats.csv").read_text() == first_segment
+    assert [segment["file"] for segment in saver.segments] == ["stats.csv", "stats.1.csv"]
+    assert saver.columns == ["foo", "bar", "baz"]
+
+    df = saver.load(column_types={"foo": "str", "bar": "int64", "baz": "float64"})
+    assert df["foo"].tolist() == ["a,\nb", "c", "d"]
+    assert df["bar"].isna().tolist() == [False, True, False]
+    assert df["baz"].isna().tolist() == [True, False, True]
+    assert Saver("csv://{}".format(tmp_path / "stats.csv")).load()["foo"].tolist() == ["a,\nb", "c", "d"]
+
+
+def test_parquet_partitions(tmp_path):
+    pytest.importorskip("pyarrow")
+    saver = Saver("parquet://{}".format(tmp_path / "stats"))
+    column_types = {"context_id": "str", "start_time": "datetime64[ns]", "flow_label": "str", "history_id": "int64"}
+    first = pd.DataFrame(
+        {
+            "context_id": ["a", "b", "c"],
+            "start_time": pd.to_datetime(["2022-05-30 10:00", "2022-05-31 10:00", "2022-05-31 12:00"]),
+            "flow_label": ["root", "root", "greeting"],
+        }
+    )
+    second = pd.DataFrame(
+        {
+            "context_id": ["d"],
+            "start_time": pd.to_datetime(["2022-06-01 09:00"]),
+            "flow_label": ["root"],
+            "history_id": [3],
+        }
+    )
+    saver.save([first], column_types, ["start_time"])
+    saver.save([second], column_types, ["start_time"])
+    assert [partition.name for partition in saver.partitions()] == [
+        "date=2022-05-30",
+        "date=2022-05-31",
+        "date=2022-06-01",
+    ]
+    metadata = pq.ParquetFile(next((tmp_path / "stats" / "date=2022-05-31").glob("*.parquet"))).metadata
+    assert metadata.num_row_groups == 1
+    assert metadata.row_group(0).column(0).compression == "ZSTD"
+
+    df = saver.load(column_types, ["start_time"])
+    assert sorted(df["context_id"]) == ["a", "b", "c", "d"]
+    assert df["history_id"].isna().sum() == 3
+
+    time_range = (pd.Timestamp("2022-05-31 11:00"), pd.Timestamp("2022-06-01 23:00"))
+    assert saver.partitions(time_range)[0].name == "date=2022-05-31"
+    df = saver.load({"context_id": "str"}, time_range=time_range)
+    assert list(df.columns) == ["context_id"]
+    assert sorted(df["context_id"]) == ["c", "d"]
+
+
+def test_parquet_rows_without_start_time(tmp_path):
+    pytest.importorskip("pyarrow")
+    saver = Saver("parquet://{}".format(tmp_path / "stats"))
+    column_types = {"context_id": "str", "start_time": "datetime64[ns]"}
+    df = pd.DataFrame({"context_id": ["a", "b"], "start_time": pd.to_datetime(["2022-05-30 10:00", None])})
+    saver.save([df], column_types, ["start_time"])
+    saver.save([pd.DataFrame({"context_id": ["c"]})], column_types, ["start_time"])
+    assert [partition.name for partition in saver.partitions()] == [
+        "date=2022-05-30",
+        "date=__HIVE_DEFAULT_PARTITION__",
+    ]
+    assert sorted(saver.load(column_types)["context_id"]) == ["a", "b", "c"]
+    time_range = (pd.Timestamp("2022-05-01"), pd.Timestamp("2022-06-01"))
+    assert saver.load(column_types, time_range=time_range)["context_id"].tolist() == ["a"]
+
+
+def test_parquet_column_types(tmp_path):
+    pytest.importorskip("pyarrow")
+    saver = Saver("parquet://{}".format(tmp_path / "stats"))
+    column_types = {"context_id": "str", "start_time": "datetime64[ns]", "user_tag": "str", "history_id": "int64"}
+    start_time = pd.to_datetime(["2022-05-30 10:00"])
+    # a file written without the column types, the tag is stored as int64
+    saver.save([pd.DataFrame({"context_id": ["a"], "start_time": start_time, "user_tag": [1], "history_id": [1]})])
+    for dfs in (
+        [pd.DataFrame({"context_id": ["b"], "start_time": start_time, "user_tag": ["vip"], "history_id": [2]})],
+        [pd.DataFrame({"context_id": ["c"], "start_time": start_time, "user_tag": [None], "history_id": [None]})],
+        [pd.DataFrame({"context_id": ["d"], "start_time": start_time, "user_tag": [{"a": 1}], "history_id": [3]})],
+    ):
+        saver.save(dfs, column_types, ["start_time"])
+
+    df = saver.load(column_types, ["start_time"]).sort_values("context_id")
+    assert df["user_tag"].tolist() == [1, "vip", None, '{"a": 1}']
+    assert df["history_id"].tolist()[:2] == [1, 2]
+    assert df["history_id"].isna().sum() == 1
+    chunks = list(saver.iter_load(column_types, ["start_time"], filters={"context_id": ["a", "b"]}))
+    assert pd.concat(chunks).sort_values("context_id")["user_tag"].tolist() == [1, "vip"]
+
+
+def test_arrow_append(tmp_path):
+    pytest.importorskip("pyarrow")
+    saver = Saver("arrow://{}".format(tmp_path / "stats.arrow"))
+    column_types = {"context_id": "str", "history_id": "int64", "duration_time": "float64"}
+    for index in range(3):
+        batch = pd.DataFrame({"context_id": [str(index)] * 2, "history_id": [0, 1], "duration_time": [0.1, 0.2]})
+        saver.save([batch], column_types, [])
+    size = (tmp_path / "stats.arrow").stat().st_size
+    saver.save([pd.DataFrame({"context_id": ["3"], "duration_time": [0.3]})], column_types, [])
+    assert (tmp_path / "stats.arrow").stat().st_size > size
+    assert saver.segments == [tmp_path / "stats.arrow"]
+
+    saver.save([pd.DataFrame({"context_id": ["4"], "flow_label": ["root"]})], column_types, [])
+    assert saver.segments == [tmp_path / "stats.arrow", tmp_path / "stats.1.arrow"]
+
+    df = Saver("arrow://{}".format(tmp_path / "stats.arrow")).load(column_types, [])
+    assert list(df.columns) == list(column_types)
+    assert df["context_id"].tolist() == ["0", "0", "1", "1", "2", "2", "3", "4"]
+    assert df["history_id"].isna().sum() == 2
+    assert Saver("arrow://{}".format(tmp_path / "stats.arrow")).load()["flow_label"].notna().sum() == 1
+
+
+def test_sqlite_saving(tmp_path, data_generator):
+    saver = Saver("sqlite://{}".format(tmp_path / "stats.db"))
+    stats = Stats(saver=saver)
+    stats = data_generator(stats, 3)
+    stats.save()
+    assert saver.connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    indexes = {row[1] for row in saver.connection.execute("PRAGMA index_list(dff_stats)")}
+    assert indexes == {"dff_stats_context_id", "dff_stats_start_time"}
+    df = saver.load(column_types=stats.column_dtypes, parse_dates=stats.parse_dates)
+    assert len(df) > 0
+    assert str(df["start_time"].dtype) == "datetime64[ns]"
+
+    saver.save([pd.DataFrame({"context_id": ["new"], "flow_label": ["root"]})], {"flow_label": "str"}, [])
+    column_types = dict(stats.column_dtypes, flow_label="str")
+    df = Saver("sqlite://{}".format(tmp_path / "stats.db")).load(column_types=column_types, parse_dates=["start_time"])
+    assert df["flow_label"].notna().sum() == 1
+    assert df["context_id"].iloc[-1] == "new"
+
+
+def test_sqlite_json_values(tmp_path):
+    saver = Saver("sqlite://{}".format(tmp_path / "stats.db"))
+    df = pd.DataFrame({"context_id": ["a", "b"], "misc": [{"foo": [1, 2]}, ["bar"]]})
+    saver.save([df], {"context_id": "str", "misc": "object"}, [])
+    df = saver.load({"context_id": "str", "misc": "object"})
+    assert df["misc"].map(json.loads).tolist() == [{"foo": [1, 2]}, ["bar"]]
+
+
+def test_CH_bulk_insert(clickhouse_stub):
+    saver = Saver(clickhouse_stub.uri)
+    df = pd.DataFrame(
+        {
+            "context_id": ["a", "b"],
+            "start_time": pd.to_datetime(["2022-05-30 10:00:00.5", "2022-05-30 10:00:01"]),
+            "history_id": [0, 1],
+            "duration_time": [0.5, None],
+            "request": ["hi\tthere", None],
+        }
+    )
+    column_types = {"context_id": "str", "start_time": "datetime64[ns]", "history_id": "int64"}
+    saver.save([df], column_types, ["start_time"])
+    (create,) = clickhouse_stub.queries("CREATE TABLE")
+    assert "ENGINE = MergeTree ORDER BY (context_id, start_time)" in create["query"]
+    assert "`context_id` String, `start_time` DateTime64(6), `history_id` Nullable(Int64)" in create["query"]
+    (insert,) = clickhouse_stub.queries("INSERT INTO")
+    assert insert["query"].endswith("FORMAT TabSeparated")
+    assert insert["data"].splitlines() == [
+        "a\t2022-05-30 10:00:00.500000\t0\t0.5\thi\\tthere",
+        "b\t2022-05-30 10:00:01.000000\t1\t\\N\t\\N",
+    ]
+
+
+def test_CH_schema_migration(clickhouse_stub):
+    clickhouse_stub.responses["SELECT name FROM system.columns"] = "context_id\nstart_time\nhistory_id\n"
+    saver = Saver(clickhouse_stub.uri)
+    df = pd.DataFrame(
+        {"context_id": ["a"], "start_time": pd.to_datetime(["2022-05-30"]), "flow_label": ["root"], "misc": [0.5]}
+    )
+    saver.save([df], {"context_id": "str", "start_time": "datetime64[ns]", "flow_label": "str"}, ["start_time"])
+    assert not clickhouse_stub.queries("CREATE TABLE")
+    assert not clickhouse_stub.queries("DROP TABLE")
+    assert not clickhouse_stub.queries("SELECT *")
+    (alter,) = clickhouse_stub.queries("ALTER TABLE")
+    assert alter["query"] == (
+        "ALTER TABLE `dff_stats` ADD COLUMN IF NOT EXISTS `flow_label` Nullable(String), "
+        "ADD COLUMN IF NOT EXISTS `misc` Nullable(Float64)"
+    )
+    (insert,) = clickhouse_stub.queries("INSERT INTO")
+    assert insert["query"].startswith("INSERT INTO `dff_stats` (`context_id`, `start_time`, `flow_label`, `misc`)")
+
+
+def test_CH_columnar_load(clickhouse_stub):
+    clickhouse_stub.responses["SELECT name FROM system.columns"] = "context_id\nstart_time\nhistory_id\nrequest\n"
+    clickhouse_stub.responses["SELECT `"] = (
+        "context_id\tstart_time\thistory_id\trequest\n"
+        "String\tDateTime64(6)\tNullable(Int64)\tNullable(String)\n"
+        "a\t2022-05-30 10:00:00.500000\t0\thi\\tthere\n"
+        "b\t2022-05-30 10:00:01.000000\t1\t\\N\n"
+    )
+    saver = Saver(clickhouse_stub.uri)
+    time_range = (pd.Timestamp("2022-05-30"), pd.Timestamp("2022-05-31"))
+    df = saver.load(
+        column_types={"context_id": "str", "start_time": "datetime64[ns]", "history_id": "int64", "request": "str"},
+        columns=["context_id", "start_time", "history_id", "request", "flow_label"],
+        time_range=time_range,
+    )
+    (select,) = clickhouse_stub.queries("SELECT `")
+    assert select["query"] == (
+        "SELECT `context_id`, `start_time`, `history_id`, `request` FROM `dff_stats` "
+        "WHERE `start_time` BETWEEN toDateTime64('2022-05-30 00:00:00.000000', 6) "
+        "AND toDateTime64('2022-05-31 00:00:00.000000', 6) FORMAT TSVWithNamesAndTypes"
+    )
+    assert df["context_id"].tolist() == ["a", "b"]
+    assert str(df["start_time"].dtype) == "datetime64[ns]"
+    assert df["start_time"].iloc[0] == pd.Timestamp("2022-05-30 10:00:00.5")
+    assert str(df["history_id"].dtype) == "int64"
+    assert df["request"].iloc[0] == "hi\tthere"
+    assert pd.isna(df["request"].iloc[1])
+    assert df["flow_label"].isna().all()
+
+    clickhouse_stub.responses["SELECT `"] = "context_id\nString\n"
+    assert saver.load(columns=["context_id"]).empty
+
+
+PUSHDOWN_DF = pd.DataFrame(
+    {
+        "context_id": ["a", "a", "b", "c"],
+        "start_time": pd.to_datetime(["2022-05-30 10:00", "2022-05-30 10:01", "2022-05-31 12:00", "2022-06-01 09:00"]),
+        "flow_label": ["root", "greeting", "root", "root"],
+        "history_id": [0, 1, 0, 0],
+    }
+)
+PUSHDOWN_TYPES = {"context_id": "str", "start_time": "datetime64[ns]", "flow_label": "str", "history_id": "int64"}
+
+
+@pytest.mark.parametrize(
+    "uri",
+    ["csv://{}/stats.csv", "parquet://{}/stats", "arrow://{}/stats.arrow", "sqlite://{}/stats.db", "spool://{}/spool"],
+)
+def test_load_pushdown(uri, tmp_path):
+    if uri.startswith(("parquet", "arrow")):
+        pytest.importorskip("pyarrow")
+    saver = Saver(uri.format(tmp_path))
+    saver.save([PUSHDOWN_DF], PUSHDOWN_TYPES, ["start_time"])
+
+    df = saver.load(PUSHDOWN_TYPES, ["start_time"], columns=["context_id", "history_id"])
+    assert list(df.columns) == ["context_id", "history_id"]
+    assert len(df) == 4
+
+    time_range = (pd.Timestamp("2022-05-30 10:01"), pd.Timestamp("2022-05-31 23:00"))
+    df = saver.load(PUSHDOWN_TYPES, ["start_time"], time_range=time_range)
+    assert sorted(df["context_id"]) == ["a", "b"]
+    assert str(df["start_time"].dtype) == "datetime64[ns]"
+
+    df = saver.load(PUSHDOWN_TYPES, ["start_time"], columns=["context_id"], filters={"flow_label": "root"})
+    assert sorted(df["context_id"]) == ["a", "b", "c"]
+    df = saver.load(
+        PUSHDOWN_TYPES, ["start_time"], time_range=time_range, filters={"context_id": ["a", "c"], "flow_label": "root"}
+    )
+    assert len(df) == 0
+    assert saver.load(PUSHDOWN_TYPES, ["start_time"], filters={"node_label": "start"}).empty
+
+
+@pytest.mark.skipif("sqlalchemy" not in sys.modules, reason="Postgres extra not installed")
+def test_PG_load_pushdown(PG_uri_string):
+    saver = Saver(PG_uri_string)
+    saver.engine = sqlalchemy.create_engine("sqlite://")  # the query is built with the sqlalchemy core
+    PUSHDOWN_DF.to_sql("dff_stats", saver.engine, index=False)
+    time_range = (pd.Timestamp("2022-05-30 10:01"), pd.Timestamp("2022-05-31 23:00"))
+    df = saver.load(PUSHDOWN_TYPES, ["start_time"], time_range=time_range, filters={"flow_label": ["root"]})
+    assert df["context_id"].tolist() == ["b"]
+    assert list(df.columns) == list(PUSHDOWN_TYPES)
+    query, _ = saver._select(["context_id"], filters={"context_id": "a"})
+    assert "WHERE dff_stats.context_id IN" in str(query)
+
+
+def test_CH_load_pushdown(clickhouse_stub):
+    clickhouse_stub.responses["SELECT name FROM system.columns"] = "context_id\nstart_time\nflow_label\n"
+    saver = Saver(clickhouse_stub.uri)
+    saver.load(columns=["context_id"], filters={"flow_label": ["root", "it's"], "context_id": "a"})
+    (select,) = clickhouse_stub.queries("SELECT `")
+    assert select["query"] == (
+        "SELECT `context_id` FROM `dff_stats` WHERE `flow_label` IN ('root', 'it\\'s') AND `context_id` IN ('a') "
+        "FORMAT TSVWithNamesAndTypes"
+    )
+    assert saver.load(columns=["context_id"], filters={"node_label": "start"}).empty
+    assert len(clickhouse_stub.queries("SELECT `")) == 1
+
+
+@pytest.mark.parametrize(
+    "uri",
+    ["csv://{}/stats.csv", "parquet://{}/stats", "arrow://{}/stats.arrow", "sqlite://{}/stats.db", "spool://{}/spool"],
+)
+def test_iter_load(uri, tmp_path):
+    if uri.startswith(("parquet", "arrow")):
+        pytest.importorskip("pyarrow")
+    saver = Saver(uri.format(tmp_path))
+    assert list(saver.iter_load(PUSHDOWN_TYPES, ["start_time"], chunksize=2)) == []
+    for _ in range(3):
+        saver.save([PUSHDOWN_DF], PUSHDOWN_TYPES, ["start_time"])
+
+    chunks = list(saver.iter_load(PUSHDOWN_TYPES, ["start_time"], chunksize=3))
+    assert all(0 < len(chunk) <= 3 for chunk in chunks)
+    df = pd.concat(chunks, ignore_index=True)
+    assert len(df) == 12
+    assert list(df.columns) == list(PUSHDOWN_TYPES)
+    assert str(df["history_id"].dtype) == "int64"
+
+    chunks = saver.iter_load(PUSHDOWN_TYPES, ["start_time"], columns=["context_id"], filters={"flow_label": "root"})
+    assert sorted(pd.concat(chunks)["context_id"]) == ["a", "a", "a", "b", "b", "b", "c", "c", "c"]
+
+
+def test_arrow_iter_load_filters_batches(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    from dff_node_stats.savers import arrow
+
+    saver = Saver("arrow://{}".format(tmp_path / "stats.arrow"))
+    for _ in range(5):
+        saver.save([PUSHDOWN_DF], PUSHDOWN_TYPES, ["start_time"])
+    filtered = []
+    filter_table = arrow._filter_table
+
+    def spy(table, *args, **kwargs):
+        filtered.append(table.num_rows)
+        return filter_table(table, *args, **kwargs)
+
+    monkeypatch.setattr(arrow, "_filter_table", spy)
+    chunks = list(saver.iter_load(PUSHDOWN_TYPES, ["start_time"], filters={"flow_label": "root"}, chunksize=4))
+    assert [len(chunk) for chunk in chunks] == [4, 4, 4, 3]
+    assert filtered == [len(PUSHDOWN_DF)] * 5
+    assert (pd.concat(chunks)["flow_label"] == "root").all()
+
+
+@pytest.mark.skipif("sqlalchemy" not in sys.modules, reason="Postgres extra not installed")
+def test_PG_iter_load(PG_uri_string):
+    saver = Saver(PG_uri_string)
+    saver.engine = sqlalchemy.create_engine("sqlite://")
+    PUSHDOWN_DF.to_sql("dff_stats", saver.engine, index=False)
+    chunks = list(saver.iter_load(PUSHDOWN_TYPES, ["start_time"], chunksize=3))
+    assert [len(chunk) for chunk in chunks] == [3, 1]
+    assert str(chunks[0]["start_time"].dtype) == "datetime64[ns]"
+
+
+def test_CH_iter_load(clickhouse_stub):
+    clickhouse_stub.responses["SELECT name FROM system.columns"] = "context_id\nhistory_id\n"
+    clickhouse_stub.responses["SELECT `"] = "context_id\thistory_id\nString\tInt64\n" + "".join(
+        f"{index}\t{index}\n" for index in range(10)
+    )
+    saver = Saver(clickhouse_stub.uri)
+    chunks = list(saver.iter_load({"context_id": "str", "history_id": "int64"}, chunksize=4))
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert chunks[-1]["history_id"].tolist() == [8, 9]
+    assert str(chunks[-1]["history_id"].dtype) == "int64"
+
+
+@pytest.mark.skipif("sqlalchemy" not in sys.modules, reason="Postgres extra not installed")
+def test_PG_engine_reuse(PG_uri_string):
+    from dff_node_stats.savers import pool
+
+    saver = Saver(PG_uri_string)
+    assert Saver(PG_uri_string, table="other").engine is saver.engine
+    resized = Saver(PG_uri_string, pool_size=2, max_overflow=0)
+    assert resized.engine is not saver.engine
+    assert resized.engine.pool.size() == 2
+    pool.dispose()
+    assert Saver(PG_uri_string).engine is not saver.engine
+
+
+def test_CH_session_reuse(clickhouse_stub):
+    saver = Saver(clickhouse_stub.uri)
+    assert Saver(clickhouse_stub.uri, table="other").session is saver.session
+    assert Saver(clickhouse_stub.uri.replace("://", "://other_")).session is not saver.session
+    saver.save([pd.DataFrame({"context_id": ["a"], "history_id": [0]})])
+    saver.save([pd.DataFrame({"context_id": ["b"], "history_id": [1]})])
+    assert len(clickhouse_stub.queries("INSERT INTO")) == 2
+    assert clickhouse_stub.connections == 1
+
+
+def test_async_saver(tmp_path):
+    import asyncio
+    import threading
+
+    saver = Saver("csv://{}".format(tmp_path / "stats.csv"))
+    threads = []
+    save = saver.save
+
+    def spy(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return save(*args, **kwargs)
+
+    saver.save = spy
+
+    async def run():
+        await saver.asave([PUSHDOWN_DF], PUSHDOWN_TYPES, ["start_time"])
+        return await saver.aload(PUSHDOWN_TYPES, ["start_time"], filters={"context_id": "a"})
+
+    df = asyncio.run(run())
+    assert threads[0].startswith("dff-stats-io")
+    assert df["context_id"].tolist() == ["a", "a"]
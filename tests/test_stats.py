@@ -0,0 +1,297 @@
+import datetime
+import functools
+import threading
+import uuid
+
+import pandas as pd
+import pytest
+from df_engine.core import Actor, Context
+
+from dff_node_stats import BufferLimit, FlushPolicy, Overflow, Saver, Stats
+from dff_node_stats import collectors as DSC
+
+from examples.collect_stats import plot, transitions
+
+N_THREADS = 8
+N_TURNS = 30
+
+
+def run_dialogs(stats: Stats, n_turns: int):
+    actor = Actor(plot, start_label=("root", "start"), fallback_label=("root", "fallback"))
+    stats.update_actor_handlers(actor, auto_save=False)
+    ctx = Context()
+    for _ in range(n_turns):
+        flow, node = ctx.last_label or ("root", "start")
+        answers = transitions.get(flow, {}).get(node) or ["hi"]
+        ctx.add_request(answers[0])
+        ctx = actor(ctx)
+
+
+@pytest.mark.parametrize("concurrent", [True, False])
+def test_no_rows_lost(concurrent, memory_saver):
+    saver = memory_saver
+    stats = Stats(saver=saver, collectors=[DSC.NodeLabelCollector()], concurrent=concurrent)
+    workers = [threading.Thread(target=run_dialogs, args=(stats, N_TURNS)) for _ in range(N_THREADS)]
+    done = threading.Event()
+
+    def flush_loop():
+        while not done.is_set():
+            stats.save()
+
+    flusher = threading.Thread(target=flush_loop)
+    flusher.start()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    done.set()
+    flusher.join()
+    stats.close()
+
+    rows = sum(len(df) for df in saver.dfs)
+    assert rows == N_THREADS * N_TURNS * 2  # rows are collected on CONTEXT_INIT and FINISH_TURN
+    for df in saver.dfs:
+        assert df["context_id"].notna().all()
+        assert df["flow_label"].notna().all()
+    assert len(stats.buffer) == 0
+    assert len(stats.start_times) == 0
+
+
+def test_sampling(memory_saver):
+    with pytest.raises(ValueError):
+        Stats(saver=memory_saver, sample_rate=1.5)
+    stats = Stats(saver=memory_saver, collectors=[DSC.StageTimingCollector()], sample_rate=0.5)
+    ids = [uuid.uuid4() for _ in range(1000)]
+    sampled = {context_id for context_id in ids if stats.is_sampled(context_id)}
+    assert 400 < len(sampled) < 600
+    assert sampled == {context_id for context_id in ids if stats.is_sampled(context_id)}
+
+    actor = Actor(plot, start_label=("root", "start"), fallback_label=("root", "fallback"))
+    stats.update_actor_handlers(actor, auto_save=False)
+    contexts = [Context() for _ in range(20)]
+    for request in ["hi", "fine"]:
+        for ctx in contexts:
+            ctx.add_request(request)
+            actor(ctx)
+    df = stats.dfs[0]
+    expected = {str(ctx.id) for ctx in contexts if stats.is_sampled(ctx.id)}
+    assert set(df["context_id"]) == expected
+    assert (df.groupby("context_id").size() == 4).all()
+    assert (df["sample_rate"] == 0.5).all()
+    assert len(stats.collectors[1].timestamps) == 0
+
+
+@pytest.mark.parametrize(
+    "overflow,buffered,dropped",
+    [(Overflow.DROP_NEWEST, 10, 50), (Overflow.DROP_OLDEST, 10, 50)],
+)
+def test_buffer_limit_drop(overflow, buffered, dropped, memory_saver):
+    stats = Stats(saver=memory_saver, buffer_limit=BufferLimit(max_rows=10, overflow=overflow))
+    run_dialogs(stats, N_TURNS)
+    assert len(stats.buffer) == buffered
+    assert stats.dropped_rows == dropped
+
+
+def test_buffer_limit_block(memory_saver):
+    saver = memory_saver
+    stats = Stats(saver=saver, buffer_limit=BufferLimit(max_rows=10, overflow=Overflow.BLOCK))
+    run_dialogs(stats, N_TURNS)
+    stats.close()
+    assert sum(len(df) for df in saver.dfs) == N_TURNS * 2
+    assert stats.dropped_rows == 0
+
+
+def test_buffer_limit_block_background(memory_saver):
+    saver = memory_saver
+    limit = BufferLimit(max_rows=10, overflow=Overflow.BLOCK)
+    stats = Stats(saver=saver, flush_policy=FlushPolicy(max_interval=60), buffer_limit=limit)
+    actor = Actor(plot, start_label=("root", "start"), fallback_label=("root", "fallback"))
+    stats.update_actor_handlers(actor, background=True)
+    ctx = Context()
+    for _ in range(N_TURNS):
+        ctx.add_request("hi")
+        ctx = actor(ctx)
+        assert len(stats.buffer) <= 10
+    stats.close()
+    assert sum(len(df) for df in saver.dfs) == N_TURNS * 2
+    assert stats.dropped_rows == 0
+
+
+@pytest.mark.parametrize("block_timeout", [None, 30.0])
+def test_buffer_limit_block_failing_saver(block_timeout, memory_saver):
+    memory_saver.fail = True
+    limit = BufferLimit(max_rows=10, overflow=Overflow.BLOCK, block_timeout=block_timeout)
+    stats = Stats(saver=memory_saver, flush_policy=FlushPolicy(max_interval=1.0), buffer_limit=limit)
+    actor = Actor(plot, start_label=("root", "start"), fallback_label=("root", "fallback"))
+    stats.update_actor_handlers(actor, background=True)
+
+    def run_turns():
+        ctx = Context()
+        for _ in range(N_TURNS):
+            ctx.add_request("hi")
+            ctx = actor(ctx)
+
+    dialog = threading.Thread(target=run_turns, daemon=True)
+    dialog.start()
+    dialog.join(timeout=20)
+    assert not dialog.is_alive()
+    assert stats.dropped_rows > 0
+    assert len(stats.buffer) <= 10
+    memory_saver.fail = False
+    stats.close()
+    assert memory_saver.rows + stats.dropped_rows == N_TURNS * 2
+
+
+def test_buffer_limit_block_failing_saver_in_place(memory_saver):
+    saves = []
+
+    def save(dfs, column_types=None, parse_dates=False):
+        saves.append(dfs)
+        raise ConnectionError("storage is down")
+
+    memory_saver.save = save
+    stats = Stats(saver=memory_saver, buffer_limit=BufferLimit(max_rows=10, overflow=Overflow.BLOCK, block_timeout=30))
+    run_dialogs(stats, N_TURNS)
+    assert len(saves) == 1
+    assert len(stats.buffer) == 10
+    assert stats.dropped_rows == N_TURNS * 2 - 10
+
+
+def test_buffer_limit_spill(tmp_path, memory_saver):
+    saver = memory_saver
+    saver.fail = True
+    limit = BufferLimit(max_rows=10, overflow=Overflow.SPILL, spill_path=str(tmp_path))
+    stats = Stats(saver=saver, buffer_limit=limit)
+    run_dialogs(stats, N_TURNS)
+    assert len(stats.buffer) == 10
+    assert stats.spilled_rows == 50
+    with pytest.raises(ConnectionError):
+        stats.save()
+    assert stats.spilled_rows == 60
+    assert len(stats.buffer) == 0
+
+    saver.fail = False
+    assert stats.save() == N_TURNS * 2
+    assert sum(len(df) for df in saver.dfs) == N_TURNS * 2
+    assert stats.dropped_rows == 0
+    assert not list(tmp_path.iterdir())
+
+
+def test_refresh(tmp_path):
+    saver = Saver("csv://{}".format(tmp_path / "stats.csv"))
+    stats = Stats(saver=saver, collectors=[DSC.NodeLabelCollector()])
+    run_dialogs(stats, 3)
+    stats.save()
+    assert len(stats.dataframe) == 6
+
+    ranges = []
+    load = saver.load
+
+    @functools.wraps(load)
+    def spy(*args, **kwargs):
+        ranges.append(kwargs.get("time_range"))
+        return load(*args, **kwargs)
+
+    saver.load = spy
+    run_dialogs(stats, 2)
+    stats.save()
+    assert len(stats.refresh()) == 10
+    assert ranges[-1][0] == stats.dataframe["start_time"].iloc[5] - stats.refresh_lookback
+    assert len(stats.refresh()) == 10
+    assert all(time_range is not None for time_range in ranges)
+
+    # equal rows are told apart
+    latest = stats.dataframe["start_time"].max()
+    late = pd.DataFrame({"context_id": ["late", "late"], "start_time": [latest, latest]})
+    saver.save([late], stats.column_dtypes, ["start_time"])
+    df = stats.refresh()
+    assert len(df) == 12
+    assert df["context_id"].tolist().count("late") == 2
+
+
+def test_refresh_overlapping_turns(tmp_path):
+    saver = Saver("csv://{}".format(tmp_path / "stats.csv"))
+    stats = Stats(saver=saver)
+    actor = Actor(plot, start_label=("root", "start"), fallback_label=("root", "fallback"))
+    ctx_a, ctx_b = Context(), Context()
+    for ctx in [ctx_a, ctx_b]:
+        ctx.add_request("hi")
+    stats.get_start_time(ctx_a, actor)
+    stats.get_start_time(ctx_b, actor)
+    stats.finish_turn(ctx_b, actor)
+    stats.save()
+    assert len(stats.dataframe) == 3
+
+    # the long turn is saved after a turn that started later
+    stats.finish_turn(ctx_a, actor)
+    stats.save()
+    df = stats.refresh()
+    assert len(df) == len(saver.load()) == 4
+    assert (df["context_id"] == str(ctx_a.id)).sum() == 2
+    assert len(stats.refresh()) == 4
+
+
+def test_refresh_window(tmp_path):
+    saver = Saver("csv://{}".format(tmp_path / "stats.csv"))
+    stats = Stats(saver=saver)
+    now = pd.Timestamp.now().floor("s")
+    old = pd.DataFrame({"context_id": ["old"], "start_time": [now - pd.Timedelta(hours=1)]})
+    saver.save([old], stats.column_dtypes, ["start_time"])
+    run_dialogs(stats, 2)
+    stats.save()
+    assert len(stats.dataframe) == 5
+
+    assert len(stats.refresh()) == 5
+    assert "old" not in stats._window["context_id"].tolist()
+    run_dialogs(stats, 1)
+    stats.save()
+    assert len(stats.refresh()) == 7
+    assert len(stats._window) == 6
+
+    # a longer lookback than the window reads the whole dataframe again
+    late = pd.DataFrame({"context_id": ["late"], "start_time": [now - pd.Timedelta(minutes=30)]})
+    saver.save([late, old], stats.column_dtypes, ["start_time"])
+    df = stats.refresh(lookback=datetime.timedelta(hours=2))
+    assert df["context_id"].tolist().count("late") == 1
+    assert df["context_id"].tolist().count("old") == 2
+    assert len(stats._window) == len(df) == 9
+
+
+@pytest.mark.parametrize(
+    "buffer_limit,dropped",
+    [
+        (None, 0),
+        (BufferLimit(max_rows=10, overflow=Overflow.BLOCK), 2),
+        (BufferLimit(max_rows=10), 2),
+        (BufferLimit(max_rows=10, overflow=Overflow.DROP_NEWEST), 2),
+    ],
+)
+def test_failed_save_is_retried(memory_saver, buffer_limit, dropped):
+    stats = Stats(saver=memory_saver, buffer_limit=buffer_limit)
+    run_dialogs(stats, 5)
+    memory_saver.fail = True
+    with pytest.raises(ConnectionError):
+        stats.save()
+    assert len(stats.buffer) == 10
+    memory_saver.fail = False
+    run_dialogs(stats, 1)
+    stats.save()
+    assert memory_saver.rows == 12 - dropped
+    assert stats.dropped_rows == dropped
+
+
+def test_failed_save_respects_limit(memory_saver):
+    stats = Stats(saver=memory_saver, buffer_limit=BufferLimit(max_rows=10, overflow=Overflow.DROP_OLDEST))
+    run_dialogs(stats, 4)
+    first_id = stats.dfs[0]["context_id"].iloc[0]
+
+    def save(dfs, column_types=None, parse_dates=False):
+        run_dialogs(stats, 2)  # the rows collected while the save is running
+        raise ConnectionError("storage is down")
+
+    memory_saver.save = save
+    with pytest.raises(ConnectionError):
+        stats.save()
+    assert len(stats.buffer) == 10
+    assert stats.dropped_rows == 2
+    assert (stats.dfs[0]["context_id"] == first_id).sum() == 6